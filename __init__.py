@@ -1 +1,4 @@
-from .acugis_sftp_tool import classFactory
\ No newline at end of file
+def classFactory(iface):
+    # Imported here so the GUI-free sync engine (python -m acugis_sftp_tool) loads without QGIS
+    from .acugis_sftp_tool import classFactory
+    return classFactory(iface)
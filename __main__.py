@@ -0,0 +1,5 @@
+import sys
+
+from .sftp_sync import main
+
+sys.exit(main())
@@ -1,19 +1,447 @@
 import os
 import json
-import paramiko
-from qgis.PyQt.QtWidgets import QAction, QFileDialog, QMessageBox, QInputDialog, QProgressBar, QLineEdit, QComboBox, QDialog, QVBoxLayout, QLabel, QFormLayout, QPushButton, QHBoxLayout, QListWidget, QTreeWidget, QTreeWidgetItem, QTextEdit, QCheckBox
+import time
+import posixpath
+import threading
+from qgis.PyQt.QtWidgets import QAction, QFileDialog, QMessageBox, QInputDialog, QProgressBar, QLineEdit, QComboBox, QDialog, QVBoxLayout, QLabel, QFormLayout, QPushButton, QHBoxLayout, QListWidget, QListWidgetItem, QTreeWidget, QTreeWidgetItem, QPlainTextEdit, QCheckBox
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtCore import Qt, QTimer, QCoreApplication, QEventLoop
-from qgis.core import QgsProject
+from qgis.PyQt.QtCore import Qt, QTimer, QFileSystemWatcher, pyqtSignal
+from qgis.core import QgsProject, QgsTask, QgsApplication, QgsProviderRegistry, QgsRenderContext
 from qgis.utils import iface
+from .sftp_sync import (
+    REPORT_DIR, DEFAULT_MAX_PARALLEL, DEFAULT_CHUNK_SIZE_KB,
+    DEFAULT_DELTA_THRESHOLD_MB, DEFAULT_KEEP_RELEASES, DEFAULT_EXCLUDES,
+    OVERWRITE_YES, OVERWRITE_NO, OVERWRITE_YES_TO_ALL, OVERWRITE_NO_TO_ALL,
+    SFTPSyncJob, LocalScan, connection_pool, list_remote_dirs, remote_dir_cache,
+    load_config, save_config, server_setting, remember_tuning,
+)
+
+# Most subdirectories listed ahead when a node of the browser is expanded
+PREFETCH_MAX_DIRS = 50
+
+# Auto-upload watches the project directory and only rescans what changed between
+# saves. Trees with more directories than this are walked completely every time,
+# as are saves after more than MAX_DIRTY_PATHS changes, and one save per
+# FULL_WALK_INTERVAL seconds to catch files modified in place outside QGIS.
+MAX_WATCHED_DIRS = 5000
+MAX_DIRTY_PATHS = 10000
+FULL_WALK_INTERVAL = 3600
+
+# Seconds without another save before an auto-upload starts, per project
+DEFAULT_QUIET_PERIOD = 5
+
+# What an upload sends: everything below the project directory, or only the
+# project file and the files its layers use
+SCOPE_DIRECTORY = "directory"
+SCOPE_DEPENDENCIES = "dependencies"
+
+# Files next to a layer's data source that belong to it: same base name with
+# these extensions, or the full file name with these suffixes
+SIDECAR_EXTENSIONS = (".shx", ".dbf", ".prj", ".cpg", ".qix", ".sbn", ".sbx", ".qml", ".sld", ".qmd",
+                      ".tfw", ".tifw", ".wld", ".jgw", ".pgw", ".gfw")
+SIDECAR_SUFFIXES = (".aux.xml", ".ovr", ".msk", ".xml")
+
+# Lines kept in the log views, the full log can still be exported
+LOG_VIEW_LINES = 1000
+
+
+def layer_source_paths(project):
+    """Local files the layers of a project read from"""
+    paths = set()
+    registry = QgsProviderRegistry.instance()
+    for layer in project.mapLayers().values():
+        path = registry.decodeUri(layer.providerType(), layer.source()).get("path")
+        if path and os.path.isfile(path):
+            paths.add(os.path.normpath(path))
+    return paths
+
+
+def symbol_file_paths(symbol):
+    """SVG and raster image files used by a symbol and its sub-symbols"""
+    paths = []
+    for symbol_layer in symbol.symbolLayers():
+        for getter in ("path", "svgFilePath", "imageFilePath"):
+            value = getattr(symbol_layer, getter, None)
+            value = value() if callable(value) else None
+            if isinstance(value, str) and value:
+                paths.append(value)
+        sub_symbol = symbol_layer.subSymbol()
+        if sub_symbol is not None:
+            paths += symbol_file_paths(sub_symbol)
+    return paths
+
+
+def project_dependencies(project):
+    """The files a project needs to be published: (paths below its directory, paths outside it).
+
+    Includes the project file and its auxiliary storage, every layer's
+    file-based data source with its sidecars (shapefile parts, styles,
+    .aux.xml, overviews, world files) and the SVG and raster images used
+    by the layers' symbols. A data source that is a directory contributes
+    all files below it.
+    """
+    project_path = os.path.normpath(project.fileName())
+    project_dir = os.path.dirname(project_path)
+    base = os.path.splitext(project_path)[0]
+    candidates = {project_path, base + ".qgd"}
+
+    data_paths = set()
+    registry = QgsProviderRegistry.instance()
+    for layer in project.mapLayers().values():
+        path = registry.decodeUri(layer.providerType(), layer.source()).get("path")
+        if path and os.path.exists(path):
+            data_paths.add(os.path.normpath(path))
+        renderer = layer.renderer() if hasattr(layer, "renderer") else None
+        if renderer is not None and hasattr(renderer, "symbols"):
+            for symbol in renderer.symbols(QgsRenderContext()):
+                candidates.update(os.path.normpath(path) for path in symbol_file_paths(symbol))
+
+    for path in data_paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                candidates.update(os.path.join(root, file) for file in files)
+            continue
+        candidates.add(path)
+        stem = os.path.splitext(path)[0]
+        candidates.update(stem + extension for extension in SIDECAR_EXTENSIONS)
+        candidates.update(path + suffix for suffix in SIDECAR_SUFFIXES)
+
+    inside = set()
+    outside = set()
+    for path in candidates:
+        if not os.path.isfile(path):
+            continue
+        try:
+            below_project = os.path.commonpath([project_dir, os.path.abspath(path)]) == project_dir
+        except ValueError:
+            below_project = False  # Another drive
+        if below_project:
+            inside.add(path)
+        elif path in data_paths:
+            # Images from the QGIS symbol library are installed on the server anyway
+            outside.add(path)
+    return inside, outside
+
+
+class ProjectWatcher:
+    """Collects the directories below a project directory that changed between saves.
+
+    Directories are watched for added, removed and renamed files - which
+    is also how QGIS saves projects and how SQLite journals come and go.
+    Files edited in place are not seen by a directory watch, so the
+    project file and the layer sources are checked on every save anyway.
+
+    take() returns what to scan for the next auto-upload, or None when
+    the whole directory has to be walked: before the first full sync,
+    after the dirty set overflowed, and once per FULL_WALK_INTERVAL.
+    """
+
+    def __init__(self, project_dir):
+        self.project_dir = os.path.normpath(project_dir)
+        self.dirty_dirs = set()
+        self.watched = set()
+        self.needs_full_walk = True
+        self.last_full_walk = None
+        self.watcher = QFileSystemWatcher()
+        self.watcher.directoryChanged.connect(self.directory_changed)
+
+    def directory_changed(self, path):
+        if self.needs_full_walk:
+            return
+        self.mark_dirty(path)
+        # New subdirectories are watched from now on, everything in them is new
+        try:
+            new_dirs = [entry.path for entry in os.scandir(path) if entry.is_dir() and entry.path not in self.watched]
+        except OSError:
+            return  # Removed
+        for new_dir in new_dirs:
+            for root, _, _ in os.walk(new_dir):
+                self.watch([root])
+                self.mark_dirty(root)
+
+    def mark_dirty(self, path):
+        if len(self.dirty_dirs) >= MAX_DIRTY_PATHS:
+            self.overflow()
+        elif not self.needs_full_walk:
+            self.dirty_dirs.add(path)
+
+    def watch(self, paths):
+        paths = [path for path in paths if path not in self.watched]
+        if len(self.watched) + len(paths) > MAX_WATCHED_DIRS:
+            self.overflow()
+            return
+        if paths:
+            self.watcher.addPaths(paths)
+            self.watched.update(paths)
+
+    def overflow(self):
+        """Give up on the dirty set, the next upload walks everything"""
+        self.needs_full_walk = True
+        self.dirty_dirs.clear()
+
+    def take(self, files):
+        """(dirty directories, files) to scan for the next upload, None for a full walk"""
+        if self.needs_full_walk or time.monotonic() - self.last_full_walk > FULL_WALK_INTERVAL:
+            return None
+        dirty_dirs, self.dirty_dirs = self.dirty_dirs, set()
+        return dirty_dirs, set(files)
+
+    def restore(self, dirty):
+        """Put back what an upload that failed was given by take()"""
+        if dirty is not None:
+            for path in dirty[0]:
+                self.mark_dirty(path)
+
+    def full_walk_done(self, relative_dirs, started):
+        """Start watching the directories a full sync found, started is when it began (time.time())"""
+        paths = [self.project_dir] + [os.path.join(self.project_dir, *relative_dir.split("/")) for relative_dir in relative_dirs]
+        self.needs_full_walk = False
+        self.watch(paths)
+        if self.needs_full_walk:
+            return  # Too many directories to watch
+        self.last_full_walk = time.monotonic()
+        # Directories that changed while the sync was running, with some slack for coarse mtimes
+        for path in paths:
+            try:
+                if os.stat(path).st_mtime >= started - 2:
+                    self.mark_dirty(path)
+            except OSError:
+                self.mark_dirty(path)
+
+    def stop(self):
+        if self.watched:
+            self.watcher.removePaths(list(self.watched))
+        self.watched.clear()
+
+
+class AutoUploadScheduler:
+    """Runs at most one sync per (server, remote path), coalescing saves.
+
+    A sync is a group of tasks, one per target server of a project.
+    request() (re)starts a quiet-period timer, so a burst of saves leads to
+    a single auto-upload. When the timer fires while a sync to any of the
+    same servers and remote path is running, an auto-upload that is still scanning is canceled
+    and started over with the merged changes; one that is already
+    transferring - or an interactive upload - is left to finish and one
+    more auto-upload follows it.
+
+    start(settings) creates and runs the auto-upload tasks, returning
+    them (an empty list if nothing was started).
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.timers = {}
+        self.settings = {}
+        self.running = {}
+        self.pending = set()
+
+    @staticmethod
+    def key(server_names, remote_path):
+        return (tuple(server_names), remote_path.rstrip('/') or '/')
+
+    def request(self, key, settings, quiet_period):
+        self.settings[key] = settings
+        timer = self.timers.get(key)
+        if timer is None:
+            timer = QTimer()
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda: self.fire(key))
+            self.timers[key] = timer
+        timer.start(int(quiet_period * 1000))
+
+    def fire(self, key):
+        tasks = self.overlapping(key)
+        if not tasks:
+            self.launch(key)
+            return
+        self.pending.add(key)
+        if all(task.automatic and not task.job.transfer_started for task in tasks):
+            for task in tasks:
+                task.superseded = True
+                task.cancel()
+
+    def launch(self, key):
+        self.pending.discard(key)
+        tasks = self.start(self.settings[key])
+        if tasks:
+            self.track(key, tasks)
+
+    def track(self, key, tasks):
+        """Count tasks as the running sync of key until all of them finished"""
+        self.running[key] = tasks
+        remaining = set(tasks)
+
+        def finished(task):
+            remaining.discard(task)
+            if remaining:
+                return
+            if self.running.get(key) is tasks:
+                del self.running[key]
+            for pending_key in list(self.pending):
+                if not self.busy(pending_key):
+                    self.launch(pending_key)
+
+        for task in tasks:
+            task.taskCompleted.connect(lambda task=task: finished(task))
+            task.taskTerminated.connect(lambda task=task: finished(task))
+
+    def overlapping(self, key):
+        """Tasks of the running syncs to any of the servers of key and its remote path"""
+        server_names, remote_path = key
+        return [
+            task
+            for (names, path), tasks in self.running.items() if path == remote_path and set(names) & set(server_names)
+            for task in tasks
+        ]
+
+    def busy(self, key):
+        """Whether a sync to any of the servers of key and its remote path is running"""
+        return bool(self.overlapping(key))
+
+    def stop(self):
+        for timer in self.timers.values():
+            timer.stop()
+        self.timers.clear()
+        self.pending.clear()
+
+
+def target_servers(settings):
+    """Names of the servers auto_upload_settings upload to, the main one first"""
+    names = [settings.get("server_name", "")] + list(settings.get("extra_servers", []))
+    return [name for i, name in enumerate(names) if name and name not in names[:i]]
+
+
+def report_directory(settings):
+    """Where sync reports go for these auto_upload_settings, None when turned off"""
+    if not settings.get("report"):
+        return None
+    return settings.get("report_dir") or REPORT_DIR
+
+
+class SFTPUploadTask(QgsTask):
+    """Runs an SFTPSyncJob in the QGIS task manager so the GUI stays responsive"""
+
+    logMessage = pyqtSignal(str)
+    statusChanged = pyqtSignal(str)
+    overwriteRequested = pyqtSignal(str)
+
+    def __init__(self, description, server_info, local_dir, remote_path, ownership_value, interactive=False, report_dir=None,
+                 dirty=None, rules="", files=None, scan=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.paused = False
+        self.error = None
+        self.log_lines = []
+        self.automatic = not interactive
+        # Canceled to make way for a newer auto-upload of the same target
+        self.superseded = False
+        self._overwrite_answer = None
+        self._overwrite_event = threading.Event()
+        self.job = SFTPSyncJob(
+            server_info, local_dir, remote_path, ownership_value,
+            ask_overwrite=self.ask_overwrite if interactive else None,
+            reconcile=interactive,
+            log=self.log,
+            progress=self.setProgress,
+            is_canceled=self.isCanceled,
+            wait_if_paused=self.wait_if_paused,
+            report_dir=report_dir,
+            status=self.statusChanged.emit,
+            dirty=dirty,
+            rules=rules,
+            files=files,
+            scan=scan,
+        )
+
+    def run(self):
+        try:
+            self.job.run()
+        except Exception as e:
+            self.error = e
+            return False
+        return not self.isCanceled()
+
+    def log(self, message):
+        self.log_lines.append(message)
+        self.logMessage.emit(message)
+
+    def finished(self, result):
+        # Back in the GUI thread: keep what adaptive mode learned for the next upload
+        learned = self.job.learned_tuning()
+        if learned:
+            try:
+                remember_tuning(self.job.server_info, learned)
+            except (OSError, ValueError) as e:
+                print(f"Could not save the learned transfer settings: {e}")
+
+    def wait_if_paused(self):
+        while self.paused and not self.isCanceled():
+            time.sleep(0.1)
+
+    def ask_overwrite(self, local_path):
+        """Called from the worker thread - blocks until the GUI answers"""
+        self._overwrite_event.clear()
+        self.overwriteRequested.emit(local_path)
+        while not self._overwrite_event.wait(0.1):
+            if self.isCanceled():
+                return OVERWRITE_NO_TO_ALL
+        return self._overwrite_answer
+
+    def set_overwrite_answer(self, answer):
+        self._overwrite_answer = answer
+        self._overwrite_event.set()
+
+
+class RemoteListTask(QgsTask):
+    """Lists remote directories in the background for the remote path browser.
+
+    Results go into remote_dir_cache and are announced with listed(path,
+    names) one directory at a time.
+    """
+
+    listed = pyqtSignal(str, object)
+    listFailed = pyqtSignal(str, str)
+
+    def __init__(self, server_info, paths):
+        super().__init__("Listing remote directories", QgsTask.CanCancel)
+        self.server_info = server_info
+        self.paths = paths
+        self.error = None
+
+    def run(self):
+        try:
+            with connection_pool.session(self.server_info) as session:
+                sftp = session.open_sftp()
+                try:
+                    for path in self.paths:
+                        if self.isCanceled():
+                            return False
+                        try:
+                            dirs = list_remote_dirs(sftp, path)
+                        except IOError as e:
+                            self.listFailed.emit(path, str(e))
+                            continue
+                        remote_dir_cache.put(self.server_info, path, dirs)
+                        self.listed.emit(path, dirs)
+                finally:
+                    sftp.close()
+        except Exception as e:
+            self.error = e
+            return False
+        return True
 
-CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".sftp_uploader_config.json")
 
 class AcugisSFTPTool:
     def __init__(self, iface):
         self.iface = iface
         self.upload_action = None
         self.config_action = None
+        # Python references to running tasks, the task manager only holds the C++ side
+        self.active_tasks = []
+        self.pool_timer = None
+        # Changes below the open project's directory, for auto-upload
+        self.project_watcher = None
+        self.scheduler = AutoUploadScheduler(self.perform_auto_upload)
 
     def initGui(self):
         plugin_dir = os.path.dirname(__file__)
@@ -32,6 +460,12 @@ class AcugisSFTPTool:
         
         # Connect to project saved signal for auto-upload
         QgsProject.instance().projectSaved.connect(self.on_project_saved)
+        QgsProject.instance().cleared.connect(self.stop_project_watcher)
+
+        # Close pooled connections nobody has used for a while
+        self.pool_timer = QTimer()
+        self.pool_timer.timeout.connect(connection_pool.evict_idle)
+        self.pool_timer.start(60 * 1000)
         
     def on_project_saved(self):
         """Called when QGIS project is saved - check if auto-upload is enabled"""
@@ -44,8 +478,9 @@ class AcugisSFTPTool:
             if not settings.get("enabled", False):
                 return
                 
-            # Auto-upload is enabled, perform upload
-            self.perform_auto_upload(settings)
+            # Auto-upload is enabled, upload once saving pauses
+            key = self.scheduler.key(target_servers(settings), settings.get("remote_path", ""))
+            self.scheduler.request(key, settings, server_setting(settings, "quiet_period", DEFAULT_QUIET_PERIOD))
             
         except Exception as e:
             print(f"Auto-upload error: {e}")
@@ -54,23 +489,70 @@ class AcugisSFTPTool:
         # Disconnect project saved signal
         try:
             QgsProject.instance().projectSaved.disconnect(self.on_project_saved)
+            QgsProject.instance().cleared.disconnect(self.stop_project_watcher)
         except:
             pass
+        self.stop_project_watcher()
+
+        for task in list(self.active_tasks):
+            task.cancel()
+
+        self.scheduler.stop()
+        if self.pool_timer:
+            self.pool_timer.stop()
+        connection_pool.close_all()
             
         self.iface.removePluginMenu("&AcuGIS SFTP", self.upload_action)
         self.iface.removeToolBarIcon(self.upload_action)
         self.iface.removePluginMenu("&AcuGIS SFTP", self.config_action)
         self.iface.removeToolBarIcon(self.config_action)
 
+    def stop_project_watcher(self):
+        if self.project_watcher:
+            self.project_watcher.stop()
+            self.project_watcher = None
+
+    def watcher_for(self, project_dir):
+        """The ProjectWatcher of project_dir, replacing one of another directory"""
+        if self.project_watcher and self.project_watcher.project_dir != os.path.normpath(project_dir):
+            self.stop_project_watcher()
+        if self.project_watcher is None:
+            self.project_watcher = ProjectWatcher(project_dir)
+        return self.project_watcher
+
+    def scope_files(self, settings):
+        """The files to upload for the settings' scope, None for the whole project directory"""
+        if settings.get("scope") != SCOPE_DEPENDENCIES:
+            return None
+        inside, outside = project_dependencies(QgsProject.instance())
+        for path in sorted(outside):
+            print(f"Not uploaded, outside the project directory: {path}")
+        if outside:
+            self.iface.messageBar().pushMessage(
+                "AcuGIS SFTP",
+                f"{len(outside)} layer data sources are outside the project directory and are not uploaded",
+                level=1,  # Warning level
+                duration=10
+            )
+        return sorted(inside)
+
+    def run_task(self, task):
+        """Hand a task to the QGIS task manager, keeping it alive until it finishes"""
+        self.active_tasks.append(task)
+
+        def forget():
+            if task in self.active_tasks:
+                self.active_tasks.remove(task)
+
+        task.taskCompleted.connect(forget)
+        task.taskTerminated.connect(forget)
+        QgsApplication.taskManager().addTask(task)
+
     def load_config(self):
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        return {}
+        return load_config()
 
     def save_config(self, config):
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        save_config(config)
 
     def configure_servers(self):
         config = self.load_config()
@@ -103,12 +585,48 @@ class AcugisSFTPTool:
                 self.password = QLineEdit()
                 self.password.setEchoMode(QLineEdit.Password)
                 self.port = QLineEdit()
+                self.max_parallel = QLineEdit()
+                self.delta_threshold = QLineEdit()
+                self.chunk_size = QLineEdit()
+                self.bandwidth_limit = QLineEdit()
+                self.adaptive = QCheckBox("Tune parallel transfers and chunk size automatically")
+                self.adaptive.setToolTip("Adds parallel transfers and grows the chunk size while throughput improves and backs off "
+                                         "on errors. What was learned is kept for the next upload.")
+                self.releases = QLineEdit()
+                self.releases.setToolTip("Upload into a new release directory next to the remote path and switch the remote path "
+                                         "over to it with a symlink once complete. Unchanged files are hard-linked from the "
+                                         "previous release. Needs shell access with cp, ln and mv.")
+                self.ciphers = QLineEdit()
+                self.ciphers.setPlaceholderText("e.g. aes128-ctr, aes256-ctr")
+                self.compress = QCheckBox("Use SSH compression")
+                self.compress_files = QCheckBox("Compress project, vector and uncompressed raster files while sending (needs shell access with gzip)")
+                self.compress_files.setToolTip("Only files that compress well are compressed, already compressed formats like "
+                                               ".qgz, JPEG, PNG and COG are sent as they are.")
+                self.find_manifest = QCheckBox("List remote files with a single 'find' command (needs shell access)")
+                self.checksum = QCheckBox("Compare file contents (SHA-256) and verify uploads")
+                self.bulk_tar = QCheckBox("Send many small files as one tar stream (needs shell access)")
+                self.rules = QPlainTextEdit()
+                self.rules.setPlaceholderText("One gitignore-style pattern per line, e.g. scratch/ or *.tif, !keep.tif")
+                self.rules.setMaximumHeight(80)
 
                 self.form_layout.addRow("Server Name:", self.server_name)
                 self.form_layout.addRow("Host:", self.host)
                 self.form_layout.addRow("Username:", self.username)
                 self.form_layout.addRow("Password:", self.password)
                 self.form_layout.addRow("Port (default 3839):", self.port)
+                self.form_layout.addRow(f"Max Parallel Transfers (default {DEFAULT_MAX_PARALLEL}):", self.max_parallel)
+                self.form_layout.addRow(f"Delta Transfer Above MB (default {DEFAULT_DELTA_THRESHOLD_MB}, 0 = off):", self.delta_threshold)
+                self.form_layout.addRow(f"Chunk Size KB (default {DEFAULT_CHUNK_SIZE_KB}):", self.chunk_size)
+                self.form_layout.addRow("Bandwidth Limit KB/s (0 = unlimited):", self.bandwidth_limit)
+                self.form_layout.addRow(f"Keep Releases (default {DEFAULT_KEEP_RELEASES}, 0 = upload in place):", self.releases)
+                self.form_layout.addRow("Preferred Ciphers:", self.ciphers)
+                self.form_layout.addRow(self.compress)
+                self.form_layout.addRow(self.compress_files)
+                self.form_layout.addRow(self.find_manifest)
+                self.form_layout.addRow(self.checksum)
+                self.form_layout.addRow(self.bulk_tar)
+                self.form_layout.addRow(self.adaptive)
+                self.form_layout.addRow("Exclude Rules:", self.rules)
                 self.layout.addLayout(self.form_layout)
 
                 self.status_label = QLabel()
@@ -142,6 +660,40 @@ class AcugisSFTPTool:
                 self.username.setText(entry.get('username', ''))
                 self.password.setText(entry.get('password', ''))
                 self.port.setText(str(entry.get('port', '3839')))
+                self.max_parallel.setText(str(entry.get('max_parallel', DEFAULT_MAX_PARALLEL)))
+                self.delta_threshold.setText(str(entry.get('delta_threshold', DEFAULT_DELTA_THRESHOLD_MB)))
+                self.chunk_size.setText(str(entry.get('chunk_size', DEFAULT_CHUNK_SIZE_KB)))
+                self.releases.setText(str(entry.get('releases', DEFAULT_KEEP_RELEASES)))
+                self.bandwidth_limit.setText(str(entry.get('bandwidth_limit', 0)))
+                self.adaptive.setChecked(entry.get('adaptive', False))
+                self.ciphers.setText(entry.get('ciphers', ''))
+                self.compress.setChecked(entry.get('compress', False))
+                self.compress_files.setChecked(entry.get('compress_files', False))
+                self.find_manifest.setChecked(entry.get('find_manifest', False))
+                self.checksum.setChecked(entry.get('checksum', False))
+                self.bulk_tar.setChecked(entry.get('bulk_tar', True))
+                self.rules.setPlainText(entry.get('rules', ''))
+
+            def form_server_info(self):
+                return {
+                    'host': self.host.text().strip(),
+                    'username': self.username.text().strip(),
+                    'password': self.password.text().strip(),
+                    'port': int(self.port.text().strip()) if self.port.text().strip().isdigit() else 3839,
+                    'max_parallel': int(self.max_parallel.text().strip()) if self.max_parallel.text().strip().isdigit() else DEFAULT_MAX_PARALLEL,
+                    'delta_threshold': int(self.delta_threshold.text().strip()) if self.delta_threshold.text().strip().isdigit() else DEFAULT_DELTA_THRESHOLD_MB,
+                    'chunk_size': int(self.chunk_size.text().strip()) if self.chunk_size.text().strip().isdigit() else DEFAULT_CHUNK_SIZE_KB,
+                    'releases': int(self.releases.text().strip()) if self.releases.text().strip().isdigit() else DEFAULT_KEEP_RELEASES,
+                    'bandwidth_limit': int(self.bandwidth_limit.text().strip()) if self.bandwidth_limit.text().strip().isdigit() else 0,
+                    'adaptive': self.adaptive.isChecked(),
+                    'ciphers': self.ciphers.text().strip(),
+                    'compress': self.compress.isChecked(),
+                    'compress_files': self.compress_files.isChecked(),
+                    'find_manifest': self.find_manifest.isChecked(),
+                    'checksum': self.checksum.isChecked(),
+                    'bulk_tar': self.bulk_tar.isChecked(),
+                    'rules': self.rules.toPlainText().strip()
+                }
 
             def save_entry(self):
                 name = self.server_name.text().strip()
@@ -150,12 +702,11 @@ class AcugisSFTPTool:
                     self.status_label.setText("✖ Server name is required.")
                     QTimer.singleShot(4000, lambda: self.status_label.clear())
                     return
-                self.config[name] = {
-                    'host': self.host.text().strip(),
-                    'username': self.username.text().strip(),
-                    'password': self.password.text().strip(),
-                    'port': int(self.port.text().strip()) if self.port.text().strip().isdigit() else 3839
-                }
+                server_info = self.form_server_info()
+                # Not part of the form: what adaptive syncs learned
+                if 'learned' in self.config.get(name, {}):
+                    server_info['learned'] = self.config[name]['learned']
+                self.config[name] = server_info
                 if name not in [self.list_widget.item(i).text() for i in range(self.list_widget.count())]:
                     self.list_widget.addItem(name)
                 self.status_label.setStyleSheet("color: green;")
@@ -183,19 +734,27 @@ class AcugisSFTPTool:
                 self.username.clear()
                 self.password.clear()
                 self.port.clear()
+                self.max_parallel.clear()
+                self.delta_threshold.clear()
+                self.chunk_size.clear()
+                self.releases.clear()
+                self.bandwidth_limit.clear()
+                self.adaptive.setChecked(False)
+                self.ciphers.clear()
+                self.compress.setChecked(False)
+                self.compress_files.setChecked(False)
+                self.find_manifest.setChecked(False)
+                self.checksum.setChecked(False)
+                self.bulk_tar.setChecked(True)
+                self.rules.clear()
 
             def test_connection(self):
                 self.status_label.clear()
-                host = self.host.text().strip()
-                username = self.username.text().strip()
-                password = self.password.text().strip()
-                port = int(self.port.text().strip()) if self.port.text().strip().isdigit() else 3839
+                server_info = self.form_server_info()
                 try:
-                    transport = paramiko.Transport((host, port))
-                    transport.connect(username=username, password=password)
-                    sftp = paramiko.SFTPClient.from_transport(transport)
-                    sftp.close()
-                    transport.close()
+                    with connection_pool.session(server_info) as session:
+                        sftp = session.open_sftp()
+                        sftp.close()
                     self.status_label.setStyleSheet("color: green;")
                     self.status_label.setText("✔ Connection successful!")
                     QTimer.singleShot(4000, lambda: self.status_label.clear())
@@ -206,6 +765,10 @@ class AcugisSFTPTool:
 
         dlg = ConfigDialog(config)
         dlg.exec_()
+        # Keep what syncs learned while the dialog was open
+        for name, entry in self.load_config().items():
+            if name in config and 'learned' in entry:
+                config[name]['learned'] = entry['learned']
         self.save_config(config)
 
     def upload_project_directory_via_sftp(self):
@@ -234,16 +797,51 @@ class AcugisSFTPTool:
         server_dropdown.addItems(server_names)
         remote_path_input = QLineEdit()
         ownership_input = QLineEdit("www-data:www-data")
+        scope_dropdown = QComboBox()
+        scope_dropdown.addItem("Whole project directory", SCOPE_DIRECTORY)
+        scope_dropdown.addItem("Only files used by the project's layers", SCOPE_DEPENDENCIES)
+        # Further servers that get the same upload, from one local scan
+        extra_servers_list = QListWidget()
+        for name in server_names:
+            item = QListWidgetItem(name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            extra_servers_list.addItem(item)
+        extra_servers_list.setMaximumHeight(80)
 
         form_layout.addRow("Select Server:", server_dropdown)
+        form_layout.addRow("Also Upload To:", extra_servers_list)
         form_layout.addRow("Remote Path:", remote_path_input)
         form_layout.addRow("Ownership (user:group):", ownership_input)
+        form_layout.addRow("Upload:", scope_dropdown)
         layout.addLayout(form_layout)
 
         # Add auto-upload checkbox
         auto_upload_checkbox = QCheckBox("Auto-upload changed files on project save")
         auto_upload_checkbox.setToolTip("Automatically upload project directory when QGIS project is saved")
         layout.addWidget(auto_upload_checkbox)
+        quiet_period_input = QLineEdit()
+        quiet_period_input.setPlaceholderText(f"Seconds without another save before uploading (default {DEFAULT_QUIET_PERIOD})")
+        layout.addWidget(quiet_period_input)
+
+        # Project rules, applied after the built-in and the server's rules
+        rules_input = QPlainTextEdit(QgsProject.instance().readEntry("AcugisSFTP", "sync_rules", "")[0])
+        rules_input.setPlaceholderText("Exclude rules for this project, one gitignore-style pattern per line, e.g. scratch/ or !backup.qgs~")
+        rules_input.setToolTip("Built-in excludes: " + " ".join(DEFAULT_EXCLUDES))
+        rules_input.setMaximumHeight(80)
+        layout.addWidget(QLabel("Exclude Rules:"))
+        layout.addWidget(rules_input)
+
+        # Sync reports: per-phase timings and counters as JSON, for finding bottlenecks
+        report_checkbox = QCheckBox("Write a sync report (JSON) after each upload")
+        report_dir_input = QLineEdit()
+        report_dir_input.setPlaceholderText(REPORT_DIR)
+        report_summary_checkbox = QCheckBox("Show sync timings in the message bar after auto-upload")
+        report_layout = QFormLayout()
+        report_layout.addRow(report_checkbox)
+        report_layout.addRow("Report Directory:", report_dir_input)
+        report_layout.addRow(report_summary_checkbox)
+        layout.addLayout(report_layout)
         
         # Load current auto-upload setting for this project
         project_settings = QgsProject.instance().readEntry("AcugisSFTP", "auto_upload_settings", "")[0]
@@ -258,6 +856,16 @@ class AcugisSFTPTool:
                 remote_path_input.setText(settings["remote_path"])
             if settings.get("ownership"):
                 ownership_input.setText(settings["ownership"])
+            report_checkbox.setChecked(settings.get("report", False))
+            scope_dropdown.setCurrentIndex(max(0, scope_dropdown.findData(settings.get("scope", SCOPE_DIRECTORY))))
+            if "quiet_period" in settings:
+                quiet_period_input.setText(str(settings["quiet_period"]))
+            report_dir_input.setText(settings.get("report_dir", ""))
+            report_summary_checkbox.setChecked(settings.get("report_summary", False))
+            for i in range(extra_servers_list.count()):
+                item = extra_servers_list.item(i)
+                if item.text() in settings.get("extra_servers", []):
+                    item.setCheckState(Qt.Checked)
 
         browse_remote_btn = QPushButton("Browse Remote Path")
         layout.addWidget(browse_remote_btn)
@@ -287,8 +895,112 @@ class AcugisSFTPTool:
 
         browse_remote_btn.clicked.connect(browse)
 
+        # Server name -> running upload task
+        upload_tasks = {}
+
+        def pause_upload():
+            for task in upload_tasks.values():
+                task.paused = True
+
+        def resume_upload():
+            for task in upload_tasks.values():
+                task.paused = False
+
+        def stop_upload():
+            for task in upload_tasks.values():
+                task.cancel()
+
+        pause_btn.clicked.connect(pause_upload)
+        resume_btn.clicked.connect(resume_upload)
+        stop_btn.clicked.connect(stop_upload)
+        upload_dialog.rejected.connect(stop_upload)
+
+        def ask_overwrite(server_name, local_path):
+            overwrite = QMessageBox.question(
+                upload_dialog,
+                "File Exists",
+                f"{os.path.basename(local_path)} already exists on {server_name}. Overwrite?",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.YesToAll | QMessageBox.NoToAll
+            )
+            answers = {
+                QMessageBox.Yes: OVERWRITE_YES,
+                QMessageBox.YesToAll: OVERWRITE_YES_TO_ALL,
+                QMessageBox.NoToAll: OVERWRITE_NO_TO_ALL,
+            }
+            upload_tasks[server_name].set_overwrite_answer(answers.get(overwrite, OVERWRITE_NO))
+
+        def show_log(log_lines):
+            log_dialog = QDialog()
+            log_dialog.setWindowTitle("Upload Log")
+            log_layout = QVBoxLayout()
+            log_label = QLabel("<b>Upload Log:</b>")
+            if len(log_lines) > LOG_VIEW_LINES:
+                log_label.setText(f"<b>Upload Log:</b> last {LOG_VIEW_LINES} of {len(log_lines)} lines, export for the full log")
+            log_layout.addWidget(log_label)
+            log_text = QPlainTextEdit("\n".join(log_lines[-LOG_VIEW_LINES:]))
+
+            log_text.setReadOnly(True)
+            log_layout.addWidget(log_text)
+
+            def export_log():
+                path, _ = QFileDialog.getSaveFileName(log_dialog, "Export Upload Log", "upload.log", "Log files (*.log *.txt)")
+                if not path:
+                    return
+                try:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write("\n".join(log_lines) + "\n")
+                except OSError as e:
+                    QMessageBox.critical(log_dialog, "Export Failed", f"Could not write {path}: {e}")
+
+            log_buttons = QHBoxLayout()
+            export_btn = QPushButton("Export...")
+            export_btn.clicked.connect(export_log)
+            close_btn = QPushButton("Close")
+            close_btn.clicked.connect(log_dialog.accept)
+            log_buttons.addWidget(export_btn)
+            log_buttons.addWidget(close_btn)
+            log_layout.addLayout(log_buttons)
+            log_dialog.setLayout(log_layout)
+            log_dialog.exec_()
+
+        def upload_finished(server_name, remaining):
+            # Servers finish independently, report once the last one is done
+            remaining.discard(server_name)
+            if remaining:
+                return
+            upload_btn.setEnabled(True)
+            errors = [f"{name}: {task.error}" if len(upload_tasks) > 1 else str(task.error)
+                      for name, task in upload_tasks.items() if task.error]
+            if errors:
+                QMessageBox.critical(None, "Upload Failed", "An error occurred: " + "\n".join(errors))
+                if len(errors) == len(upload_tasks):
+                    return
+            if not upload_dialog.isVisible():
+                return
+            if any(task.isCanceled() for task in upload_tasks.values()):
+                QMessageBox.information(upload_dialog, "Upload Stopped", "The upload was stopped before all files were transferred.")
+            elif len(upload_tasks) == 1:
+                task = next(iter(upload_tasks.values()))
+                QMessageBox.information(upload_dialog, "Upload Complete",
+                                        f"Project directory uploaded successfully.\n\n{task.job.report.summary()}")
+            else:
+                summaries = "\n".join(f"{name}: {task.job.report.summary()}"
+                                      for name, task in upload_tasks.items() if not task.error)
+                QMessageBox.information(upload_dialog, "Upload Complete",
+                                        f"Project directory uploaded successfully.\n\n{summaries}")
+
+            if len(upload_tasks) == 1:
+                log_lines = next(iter(upload_tasks.values())).log_lines
+            else:
+                log_lines = [f"[{name}] {line}" for name, task in upload_tasks.items() for line in task.log_lines]
+            if log_lines:
+                show_log(log_lines)
+            upload_dialog.accept()
+
         def start_upload():
             server_name = server_dropdown.currentText()
+            extra_servers = [extra_servers_list.item(i).text() for i in range(extra_servers_list.count())
+                             if extra_servers_list.item(i).checkState() == Qt.Checked]
             remote_path = remote_path_input.text().strip()
             ownership_value = ownership_input.text().strip() or "www-data:www-data"
             
@@ -296,145 +1008,82 @@ class AcugisSFTPTool:
             auto_upload_settings = {
                 "enabled": auto_upload_checkbox.isChecked(),
                 "server_name": server_name if auto_upload_checkbox.isChecked() else "",
+                "extra_servers": extra_servers,
                 "remote_path": remote_path if auto_upload_checkbox.isChecked() else "",
-                "ownership": ownership_value if auto_upload_checkbox.isChecked() else ""
+                "ownership": ownership_value if auto_upload_checkbox.isChecked() else "",
+                "report": report_checkbox.isChecked(),
+                "report_dir": report_dir_input.text().strip(),
+                "report_summary": report_summary_checkbox.isChecked(),
+                "scope": scope_dropdown.currentData(),
+                "quiet_period": int(quiet_period_input.text().strip()) if quiet_period_input.text().strip().isdigit() else DEFAULT_QUIET_PERIOD
             }
+            rules = rules_input.toPlainText().strip()
+
+            targets = target_servers({"server_name": server_name, "extra_servers": extra_servers})
+            sync_key = self.scheduler.key(targets, remote_path)
+            if self.scheduler.busy(sync_key):
+                QMessageBox.warning(upload_dialog, "Upload Running",
+                                    f"An upload to {remote_path} on {', '.join(targets)} is already running, please try again when it is done.")
+                return
+            # Not while a sync to these servers runs, so its targets and the saved settings agree
             QgsProject.instance().writeEntry("AcugisSFTP", "auto_upload_settings", json.dumps(auto_upload_settings))
+            QgsProject.instance().writeEntry("AcugisSFTP", "sync_rules", rules)
             
             if not server_name or not remote_path:
                 QMessageBox.warning(upload_dialog, "Missing Info", "Please select a server and remote path.")
                 return
 
-            server_info = config[server_name]
             project_path = QgsProject.instance().fileName()
             if not project_path:
                 QMessageBox.warning(None, "No Project", "Please save the QGIS project first.")
                 return
 
             project_dir = os.path.dirname(project_path)
-            try:
-                transport = paramiko.Transport((server_info['host'], server_info['port']))
-                transport.connect(username=server_info['username'], password=server_info['password'])
-                sftp = paramiko.SFTPClient.from_transport(transport)
-
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(server_info['host'], port=server_info['port'], username=server_info['username'], password=server_info['password'])
-
-                file_list = []
-                for root, _, files in os.walk(project_dir):
-                    for file in files:
-                        local_path = os.path.join(root, file)
-                        relative_path = os.path.relpath(local_path, project_dir)
-                        remote_file_path = os.path.join(remote_path, relative_path).replace("\\", "/")
-                        file_list.append((local_path, remote_file_path))
-
+            files = self.scope_files(auto_upload_settings)
+            # One local walk and one set of file digests for all servers
+            scan = LocalScan(project_dir, rules) if len(targets) > 1 else None
+
+            # Appended to line by line, oldest lines are dropped past LOG_VIEW_LINES
+            log_output = QPlainTextEdit()
+            log_output.setReadOnly(True)
+            log_output.setMaximumBlockCount(LOG_VIEW_LINES)
+            log_output.setMinimumHeight(120)
+
+            upload_tasks.clear()
+            remaining = set(targets)
+            for target in targets:
                 progress_bar = QProgressBar()
                 progress_bar.setMinimum(0)
-                progress_bar.setMaximum(len(file_list))
+                progress_bar.setMaximum(100)
                 progress_bar.setValue(0)
+                if len(targets) > 1:
+                    progress_bar.setFormat(f"{target}: %p%")
                 layout.addWidget(progress_bar)
 
-                log_output = QTextEdit()
-                log_output.setReadOnly(True)
-                log_output.setMinimumHeight(120)
-                layout.addWidget(log_output)
-                log_lines = []
-
-                paused = False
-                stopped = False
-
-                def pause_upload():
-                    nonlocal paused
-                    paused = True
-
-                def resume_upload():
-                    nonlocal paused
-                    paused = False
-
-                def stop_upload():
-                    nonlocal stopped
-                    stopped = True
-
-                pause_btn.clicked.connect(pause_upload)
-                resume_btn.clicked.connect(resume_upload)
-                stop_btn.clicked.connect(stop_upload)
-
-                # Moved outside the loop to retain value across files
-                yes_to_all = False
-                for i, (local_path, remote_file_path) in enumerate(file_list):
-                    if stopped:
-                        break
-                    while paused:
-                        QCoreApplication.processEvents(QEventLoop.AllEvents, 100)
-                    progress_bar.setValue(i + 1)
-                    try:
-                        skip_file = False
-                        try:
-                            remote_attr = sftp.stat(remote_file_path)
-                            local_mtime = os.path.getmtime(local_path)
-                            if int(local_mtime) <= int(remote_attr.st_mtime):
-                                skip_file = True
-                        except IOError:
-                            pass
-
-                        if skip_file and not yes_to_all:
-                            overwrite = QMessageBox.question(
-                                upload_dialog,
-                                "File Exists",
-                                f"{os.path.basename(local_path)} already exists on the server. Overwrite?",
-                                QMessageBox.Yes | QMessageBox.No | QMessageBox.YesToAll | QMessageBox.NoToAll
-                            )
-                            if overwrite == QMessageBox.No:
-                                continue
-                            elif overwrite == QMessageBox.YesToAll:
-                                yes_to_all = True
-                            elif overwrite == QMessageBox.NoToAll:
-                                break
-
-                        remote_dir = os.path.dirname(remote_file_path)
-                        dirs = remote_dir.strip('/').split('/')
-                        path_so_far = ''
-                        for d in dirs:
-                            path_so_far = f"{path_so_far}/{d}" if path_so_far else f"/{d}"
-                            try:
-                                sftp.listdir(path_so_far)
-                            except IOError:
-                                sftp.mkdir(path_so_far)
-                                ssh.exec_command(f"sudo chown {ownership_value} '{path_so_far}'")
-                        sftp.put(local_path, remote_file_path)
-                        ssh.exec_command(f"sudo chown {ownership_value} '{remote_file_path}'")
-                        log_lines.append(f"✔ Uploaded: {os.path.basename(local_path)} → {remote_file_path}")
-                        log_output.setText("\n".join(log_lines))
-
-                    except Exception as e:
-                        log_lines.append(f"✖ Failed to upload {os.path.basename(local_path)}: {e}")
-                        log_output.setText("\n".join(log_lines))
-
-                sftp.close()
-                ssh.close()
-                transport.close()
-
-                QMessageBox.information(upload_dialog, "Upload Complete", "Project directory uploaded successfully.")
-
-                if log_lines:
-                    log_dialog = QDialog()
-                    log_dialog.setWindowTitle("Upload Log")
-                    log_layout = QVBoxLayout()
-                    log_label = QLabel("<b>Upload Log:</b>")
-                    log_layout.addWidget(log_label)
-                    log_text = QTextEdit("\n".join(log_lines))
-
-                    log_text.setReadOnly(True)
-                    log_layout.addWidget(log_text)
-                    close_btn = QPushButton("Close")
-                    close_btn.clicked.connect(log_dialog.accept)
-                    log_layout.addWidget(close_btn)
-                    log_dialog.setLayout(log_layout)
-                    log_dialog.exec_()
-                upload_dialog.accept()
-            except Exception as e:
-                QMessageBox.critical(None, "Upload Failed", f"An error occurred: {e}")
+                status_label = QLabel()
+                layout.addWidget(status_label)
+
+                upload_task = SFTPUploadTask(f"Uploading project to {target}", config[target], project_dir,
+                                             remote_path, ownership_value, interactive=True,
+                                             report_dir=report_directory(auto_upload_settings), rules=rules,
+                                             files=files, scan=scan)
+                upload_task.progressChanged.connect(lambda value, progress_bar=progress_bar: progress_bar.setValue(int(value)))
+                if len(targets) > 1:
+                    upload_task.logMessage.connect(lambda message, target=target: log_output.appendPlainText(f"[{target}] {message}"))
+                    upload_task.statusChanged.connect(lambda text, status_label=status_label, target=target: status_label.setText(f"{target}: {text}"))
+                else:
+                    upload_task.logMessage.connect(log_output.appendPlainText)
+                    upload_task.statusChanged.connect(status_label.setText)
+                upload_task.overwriteRequested.connect(lambda local_path, target=target: ask_overwrite(target, local_path))
+                upload_task.taskCompleted.connect(lambda target=target: upload_finished(target, remaining))
+                upload_task.taskTerminated.connect(lambda target=target: upload_finished(target, remaining))
+                upload_tasks[target] = upload_task
+            layout.addWidget(log_output)
+
+            upload_btn.setEnabled(False)
+            for upload_task in upload_tasks.values():
+                self.run_task(upload_task)
+            self.scheduler.track(sync_key, list(upload_tasks.values()))
 
         upload_btn.clicked.connect(start_upload)
         cancel_btn.clicked.connect(upload_dialog.reject)
@@ -442,48 +1091,126 @@ class AcugisSFTPTool:
         upload_dialog.exec_()
 
     def perform_auto_upload(self, settings):
-        """Perform automatic upload in background"""
+        """Start an automatic upload to every target server as background tasks, returns the tasks"""
         try:
             config = self.load_config()
-            server_name = settings.get("server_name")
+            server_names = target_servers(settings)
             remote_path = settings.get("remote_path")
             ownership_value = settings.get("ownership", "www-data:www-data")
-            
-            if not server_name or server_name not in config:
-                print(f"Auto-upload: Server '{server_name}' not found in config")
-                return
+
+            for server_name in server_names or [""]:
+                if server_name not in config:
+                    print(f"Auto-upload: Server '{server_name}' not found in config")
+            server_names = [server_name for server_name in server_names if server_name in config]
+            if not server_names:
+                return []
                 
             if not remote_path:
                 print("Auto-upload: No remote path configured")
-                return
+                return []
                 
-            server_info = config[server_name]
             project_path = QgsProject.instance().fileName()
             
             if not project_path:
                 print("Auto-upload: No project file found")
-                return
+                return []
                 
             project_dir = os.path.dirname(project_path)
-            
-            # Show a brief notification
-            self.iface.messageBar().pushMessage(
-                "AcuGIS SFTP", 
-                f"Checking for changes and auto-uploading to {server_name}...", 
-                level=0,  # Info level
-                duration=3
-            )
-            
-            # Perform upload (simplified version without UI dialogs)
-            self.upload_files_to_server(server_info, project_dir, remote_path, ownership_value)
-            
-            # Success notification
-            self.iface.messageBar().pushMessage(
-                "AcuGIS SFTP", 
-                f"Auto-upload to {server_name} completed - only changed files uploaded!", 
-                level=3,  # Success level
-                duration=5
+
+            files = self.scope_files(settings)
+            if files is None:
+                # Only rescan what changed since the last save, plus the files QGIS edits in place
+                watcher = self.watcher_for(project_dir)
+                dirty = watcher.take({os.path.normpath(project_path)} | layer_source_paths(QgsProject.instance()))
+            else:
+                watcher, dirty = None, None
+            started = time.time()
+            rules = QgsProject.instance().readEntry("AcugisSFTP", "sync_rules", "")[0]
+            # One local walk and one set of file digests for all servers
+            scan = LocalScan(project_dir, rules) if len(server_names) > 1 else None
+
+            tasks = {}
+            for server_name in server_names:
+                task = SFTPUploadTask(f"Auto-upload to {server_name}", config[server_name], project_dir,
+                                      remote_path, ownership_value, report_dir=report_directory(settings),
+                                      dirty=dirty, rules=rules, files=files, scan=scan)
+                task.logMessage.connect(lambda message, server_name=server_name: print(f"[{server_name}] {message}"))
+                tasks[server_name] = task
+
+            # Show progress in the message bar, one bar per server, the task manager shows it too
+            message_bar = self.iface.messageBar()
+            message = message_bar.createMessage(
+                "AcuGIS SFTP",
+                f"Checking for changes and auto-uploading to {', '.join(server_names)}..."
             )
+            for server_name, task in tasks.items():
+                progress_bar = QProgressBar()
+                progress_bar.setMaximum(100)
+                if len(tasks) > 1:
+                    progress_bar.setFormat(f"{server_name}: %p%")
+                message.layout().addWidget(progress_bar)
+                prefix = f"{server_name}: " if len(tasks) > 1 else ""
+                task.progressChanged.connect(lambda value, progress_bar=progress_bar: progress_bar.setValue(int(value)))
+                task.statusChanged.connect(
+                    lambda text, progress_bar=progress_bar, prefix=prefix: progress_bar.setFormat(f"{prefix}%p% · {text}"))
+            message_bar.pushWidget(message, 0)  # Info level
+
+            remaining = set(server_names)
+
+            def result_text(server_name, task):
+                """(text, level) of one server's upload"""
+                job = task.job
+                if task.error or (task.isCanceled() and not job.uploaded):
+                    reason = task.error or "canceled"
+                    print(f"Auto-upload error ({server_name}): {reason}")
+                    return f"failed: {reason}", 2  # Critical level
+                text = f"{len(job.uploaded)} of {job.total_files} files changed and uploaded"
+                if job.failed:
+                    text += f", {len(job.failed)} failed"
+                if job.ownership_errors:
+                    text += f", setting ownership failed: {job.ownership_errors[0]}"
+                if settings.get("report_summary"):
+                    text += f" ({job.report.summary()})"
+                return text, 1 if job.failed or job.ownership_errors else 3  # Warning / Success level
+
+            def auto_upload_finished(server_name):
+                # Servers finish independently, report once the last one is done
+                remaining.discard(server_name)
+                if remaining:
+                    return
+                try:
+                    message_bar.popWidget(message)
+                except RuntimeError:
+                    pass  # Already closed by the user
+                complete = all(not task.error and not task.isCanceled() and not task.job.failed for task in tasks.values())
+                if watcher is not None and watcher is self.project_watcher:
+                    if complete and all(task.job.full_walk for task in tasks.values()):
+                        watcher.full_walk_done(next(iter(tasks.values())).job.local_dirs, started)
+                    elif not complete:
+                        watcher.restore(dirty)
+                if any(task.superseded for task in tasks.values()):
+                    return  # A newer auto-upload takes over
+
+                results = {server_name: result_text(server_name, task) for server_name, task in tasks.items()}
+                if len(results) == 1:
+                    server_name, (text, level) = next(iter(results.items()))
+                    text = f"Auto-upload failed: {text[len('failed: '):]}" if level == 2 else f"Auto-upload to {server_name} completed - {text}"
+                else:
+                    text = "Auto-upload: " + "; ".join(f"{server_name} {text}" for server_name, (text, _) in results.items())
+                    levels = [level for _, level in results.values()]
+                    level = 2 if all(level == 2 for level in levels) else min(levels)
+                message_bar.pushMessage(
+                    "AcuGIS SFTP",
+                    text,
+                    level=level,
+                    duration=10 if level == 2 or settings.get("report_summary") else 5
+                )
+
+            for server_name, task in tasks.items():
+                task.taskCompleted.connect(lambda server_name=server_name: auto_upload_finished(server_name))
+                task.taskTerminated.connect(lambda server_name=server_name: auto_upload_finished(server_name))
+                self.run_task(task)
+            return list(tasks.values())
             
         except Exception as e:
             # Error notification
@@ -494,169 +1221,172 @@ class AcugisSFTPTool:
                 duration=10
             )
             print(f"Auto-upload error: {e}")
-
-    def upload_files_to_server(self, server_info, project_dir, remote_path, ownership_value):
-        """Upload files to server without UI dialogs (for auto-upload) - only changed files"""
-        transport = paramiko.Transport((server_info['host'], server_info['port']))
-        transport.connect(username=server_info['username'], password=server_info['password'])
-        sftp = paramiko.SFTPClient.from_transport(transport)
-
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(server_info['host'], port=server_info['port'], 
-                    username=server_info['username'], password=server_info['password'])
-
-        try:
-            # Get list of all files
-            all_files = []
-            for root, _, files in os.walk(project_dir):
-                for file in files:
-                    local_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(local_path, project_dir)
-                    remote_file_path = os.path.join(remote_path, relative_path).replace("\\", "/")
-                    all_files.append((local_path, remote_file_path))
-
-            # Filter files that need uploading (new or changed)
-            files_to_upload = []
-            for local_path, remote_file_path in all_files:
-                try:
-                    # Get local file modification time
-                    local_mtime = os.path.getmtime(local_path)
-                    
-                    # Check if remote file exists and get its modification time
-                    try:
-                        remote_attr = sftp.stat(remote_file_path)
-                        remote_mtime = remote_attr.st_mtime
-                        
-                        # Only upload if local file is newer
-                        if local_mtime > remote_mtime:
-                            files_to_upload.append((local_path, remote_file_path))
-                            print(f"File changed: {os.path.basename(local_path)} (local: {local_mtime}, remote: {remote_mtime})")
-                        else:
-                            print(f"File unchanged, skipping: {os.path.basename(local_path)}")
-                            
-                    except IOError:
-                        # Remote file doesn't exist, upload it
-                        files_to_upload.append((local_path, remote_file_path))
-                        print(f"New file: {os.path.basename(local_path)}")
-                        
-                except Exception as e:
-                    print(f"Error checking file {local_path}: {e}")
-                    # If we can't check, upload it to be safe
-                    files_to_upload.append((local_path, remote_file_path))
-
-            if not files_to_upload:
-                print("No files need uploading - all files are up to date")
-                return
-
-            print(f"Uploading {len(files_to_upload)} changed/new files out of {len(all_files)} total files")
-
-            # Upload only the files that need uploading
-            for local_path, remote_file_path in files_to_upload:
-                try:
-                    # Create remote directories if needed
-                    remote_dir = os.path.dirname(remote_file_path)
-                    dirs = remote_dir.strip('/').split('/')
-                    path_so_far = ''
-                    for d in dirs:
-                        if d:  # Skip empty strings
-                            path_so_far = f"{path_so_far}/{d}" if path_so_far else f"/{d}"
-                            try:
-                                sftp.listdir(path_so_far)
-                            except IOError:
-                                sftp.mkdir(path_so_far)
-                                ssh.exec_command(f"sudo chown {ownership_value} '{path_so_far}'")
-                    
-                    # Upload file
-                    sftp.put(local_path, remote_file_path)
-                    ssh.exec_command(f"sudo chown {ownership_value} '{remote_file_path}'")
-                    print(f"✔ Uploaded: {os.path.basename(local_path)}")
-                    
-                except Exception as e:
-                    print(f"Failed to upload {local_path}: {e}")
-                    
-        finally:
-            sftp.close()
-            ssh.close()
-            transport.close()
+            return []
 
     def browse_remote_path(self, server_info, remote_path_input):
-        try:
-            transport = paramiko.Transport((server_info['host'], server_info['port']))
-            transport.connect(username=server_info['username'], password=server_info['password'])
-            sftp = paramiko.SFTPClient.from_transport(transport)
-
-            browser_dialog = QDialog()
-            browser_dialog.setWindowTitle("Select Remote Directory")
-            browser_dialog.resize(500, 400)
-
-            layout = QVBoxLayout()
-            path_label = QLabel("Selected: /")
-            layout.addWidget(path_label)
-
-            tree = QTreeWidget()
-            tree.setHeaderHidden(True)
-            layout.addWidget(tree)
-
-            folder_icon = QIcon.fromTheme("folder")
-            if folder_icon.isNull():
-                folder_icon = QIcon("/usr/share/icons/oxygen/16x16/places/folder.png")
-
-            def populate(item, path):
-                try:
-                    entries = sftp.listdir_attr(path)
-                    dirs = [e for e in entries if str(e.longname).startswith('d')]
-                    for d in sorted(dirs, key=lambda x: x.filename):
-                        child = QTreeWidgetItem([d.filename])
-                        child.setIcon(0, folder_icon)
-                        child.setData(0, Qt.UserRole, os.path.join(path, d.filename).replace("\\", "/"))
-                        child.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
-                        item.addChild(child)
-                except Exception as e:
-                    print(f"Failed to list {path}: {e}")
-
-            root_item = QTreeWidgetItem(["/"])
-            root_item.setIcon(0, folder_icon)
-            root_item.setData(0, Qt.UserRole, "/")
-            root_item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
-            tree.addTopLevelItem(root_item)
-            populate(root_item, "/")
-            root_item.setExpanded(True)
+        """Pick a remote directory; listings load in the background and are cached per server"""
+        browser_dialog = QDialog()
+        browser_dialog.setWindowTitle("Select Remote Directory")
+        browser_dialog.resize(500, 400)
 
-            def on_item_expanded(item):
-                if item.childCount() == 0:
-                    path = item.data(0, Qt.UserRole)
-                    populate(item, path)
-
-            tree.itemExpanded.connect(on_item_expanded)
-
-            def on_item_clicked(item, column):
-                path = item.data(0, Qt.UserRole)
+        layout = QVBoxLayout()
+        path_label = QLabel("Selected: /")
+        layout.addWidget(path_label)
+
+        tree = QTreeWidget()
+        tree.setHeaderHidden(True)
+        layout.addWidget(tree)
+
+        folder_icon = QIcon.fromTheme("folder")
+        if folder_icon.isNull():
+            folder_icon = QIcon("/usr/share/icons/oxygen/16x16/places/folder.png")
+
+        # Remote path -> tree item, and the paths a listing was requested for
+        items = {}
+        loading = set()
+        closed = False
+
+        def add_item(parent, name, path):
+            item = QTreeWidgetItem([name])
+            item.setIcon(0, folder_icon)
+            item.setData(0, Qt.UserRole, path)
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            cached = remote_dir_cache.get(server_info, path)
+            if cached is not None and not cached:
+                item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+            items[path] = item
+            if parent is None:
+                tree.addTopLevelItem(item)
+            else:
+                parent.addChild(item)
+            return item
+
+        def populate(item, dirs):
+            path = item.data(0, Qt.UserRole)
+            item.takeChildren()
+            for name in dirs:
+                add_item(item, name, posixpath.join(path, name))
+            if not dirs:
+                item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+            # List the new children ahead, so expanding one of them is instant
+            prefetch([posixpath.join(path, name) for name in dirs])
+
+        def show_loading(item):
+            item.takeChildren()
+            placeholder = QTreeWidgetItem(["Loading..."])
+            placeholder.setFlags(Qt.NoItemFlags)
+            item.addChild(placeholder)
+
+        def start_listing(paths, interactive):
+            paths = [path for path in paths if path not in loading]
+            if not paths:
+                return
+            loading.update(paths)
+            task = RemoteListTask(server_info, paths)
+            task.listed.connect(on_listed)
+            task.listFailed.connect(on_list_failed)
+
+            def finished():
+                loading.difference_update(paths)
+                if task.error and interactive and not closed:
+                    QMessageBox.critical(browser_dialog, "Connection Failed", f"Failed to connect: {task.error}")
+                    for path in paths:
+                        if path in items:
+                            items[path].takeChildren()
+
+            task.taskCompleted.connect(finished)
+            task.taskTerminated.connect(finished)
+            self.run_task(task)
+
+        def request(item):
+            path = item.data(0, Qt.UserRole)
+            cached = remote_dir_cache.get(server_info, path)
+            if cached is not None:
+                populate(item, cached)
+            else:
+                show_loading(item)
+                start_listing([path], interactive=True)
+
+        def prefetch(paths):
+            uncached = [path for path in paths if remote_dir_cache.get(server_info, path) is None]
+            start_listing(uncached[:PREFETCH_MAX_DIRS], interactive=False)
+
+        def on_listed(path, dirs):
+            loading.discard(path)
+            item = items.get(path)
+            if closed or item is None:
+                return
+            if item.isExpanded():
+                populate(item, dirs)
+            elif not dirs:
+                item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+
+        def on_list_failed(path, error):
+            loading.discard(path)
+            print(f"Failed to list {path}: {error}")
+            item = items.get(path)
+            if not closed and item is not None:
+                item.takeChildren()
+
+        def on_item_expanded(item):
+            # Children not shown yet, or only the loading placeholder
+            first_child = item.child(0)
+            if first_child is None or first_child.data(0, Qt.UserRole) is None:
+                request(item)
+
+        tree.itemExpanded.connect(on_item_expanded)
+
+        def on_item_clicked(item, column):
+            path = item.data(0, Qt.UserRole)
+            if path is not None:
                 path_label.setText(f"Selected: {path}")
 
-            tree.itemClicked.connect(on_item_clicked)
-
-            select_btn = QPushButton("Select This Folder")
-            layout.addWidget(select_btn)
-
-            def select_folder():
-                selected_item = tree.currentItem()
-                if not selected_item:
-                    QMessageBox.warning(browser_dialog, "No Selection", "Please select a folder.")
-                    return
-                path = selected_item.data(0, Qt.UserRole)
-                remote_path_input.setText(path)
-                browser_dialog.accept()
-
-            select_btn.clicked.connect(select_folder)
-            browser_dialog.setLayout(layout)
-            browser_dialog.exec_()
+        tree.itemClicked.connect(on_item_clicked)
 
-            sftp.close()
-            transport.close()
-
-        except Exception as e:
-            QMessageBox.critical(None, "Connection Failed", f"Failed to connect: {e}")
+        def load_root():
+            items.clear()
+            tree.clear()
+            root_item = add_item(None, "/", "/")
+            root_item.setExpanded(True)
+            if root_item.childCount() == 0:
+                request(root_item)
+
+        def refresh():
+            """List the selected directory (or everything) again, ignoring the cache"""
+            selected_item = tree.currentItem()
+            path = selected_item.data(0, Qt.UserRole) if selected_item else None
+            if path is None or path == "/":
+                remote_dir_cache.invalidate(server_info)
+                load_root()
+                return
+            remote_dir_cache.invalidate(server_info, path)
+            for cached_path in [cached_path for cached_path in items if cached_path.startswith(path + '/')]:
+                del items[cached_path]
+            selected_item.setExpanded(True)
+            request(selected_item)
+
+        button_layout = QHBoxLayout()
+        refresh_btn = QPushButton("Refresh")
+        refresh_btn.clicked.connect(refresh)
+        select_btn = QPushButton("Select This Folder")
+        button_layout.addWidget(refresh_btn)
+        button_layout.addWidget(select_btn)
+        layout.addLayout(button_layout)
+
+        def select_folder():
+            selected_item = tree.currentItem()
+            if not selected_item or selected_item.data(0, Qt.UserRole) is None:
+                QMessageBox.warning(browser_dialog, "No Selection", "Please select a folder.")
+                return
+            path = selected_item.data(0, Qt.UserRole)
+            remote_path_input.setText(path)
+            browser_dialog.accept()
+
+        select_btn.clicked.connect(select_folder)
+        browser_dialog.setLayout(layout)
+        load_root()
+        browser_dialog.exec_()
+        closed = True
 
 def classFactory(iface):
     return AcugisSFTPTool(iface)
\ No newline at end of file
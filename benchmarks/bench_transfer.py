@@ -0,0 +1,522 @@
+"""Transfer benchmarks for the SFTP sync engine, against a local stand-in server.
+
+Starts a paramiko SFTP/SSH server on localhost that serves the local
+filesystem, puts a proxy in front of it that adds latency and a bandwidth
+cap, and times SFTPSyncJob on synthetic project trees:
+
+- tiny_files: thousands of small files, like tile caches and SVG libraries
+- large_files: a few large GeoPackage-like files
+- deep_nesting: few files in a deep directory tree
+- incremental_edit: a mixed tree synced once, then a few edits synced again
+
+Both code paths are measured: "auto" is the auto-upload on save, and
+"interactive" the upload dialog, which lists the remote side. Each run
+reports wall time, files/s, MB/s and the SFTP requests and remote
+commands the server saw. Afterwards the remote files are compared with
+the local ones; a run that left any of them different reports no
+throughput. Results are written as JSON so runs can be compared over time.
+
+Exec requests are run with the local shell, so the find, sha256sum, tar
+and split based paths work on Linux and macOS. --no-shell refuses them,
+to measure the SFTP-only fallbacks.
+
+Needs paramiko, but not QGIS, e.g.:
+
+    python3 benchmarks/bench_transfer.py --latency-ms 80 --bandwidth-mbit 50 --output before.json
+    python3 benchmarks/bench_transfer.py --set max_parallel=1 --scenario tiny_files
+"""
+import argparse
+import datetime
+import filecmp
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import sftp_sync as engine  # noqa: E402
+
+USERNAME = "bench"
+PASSWORD = "bench"
+
+
+class ServerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sftp_requests = 0
+        self.exec_commands = 0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def reset(self):
+        with self._lock:
+            self.sftp_requests = 0
+            self.exec_commands = 0
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accepts the benchmark user, SFTP sessions and (optionally) exec requests"""
+
+    def __init__(self, stats, allow_exec):
+        self.stats = stats
+        self.allow_exec = allow_exec
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        if not self.allow_exec:
+            return False
+        self.stats.count("exec_commands")
+        threading.Thread(target=run_command, args=(channel, command.decode("utf-8")), daemon=True).start()
+        return True
+
+
+def run_command(channel, command):
+    """Run an exec request with the local shell, wiring it to the channel"""
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed_stdin():
+        try:
+            for data in iter(lambda: channel.recv(65536), b""):
+                process.stdin.write(data)
+        except OSError:
+            pass
+        finally:
+            process.stdin.close()
+
+    def pump(stream, send):
+        for data in iter(lambda: stream.read1(65536), b""):
+            send(data)
+
+    threads = [
+        threading.Thread(target=feed_stdin, daemon=True),
+        threading.Thread(target=pump, args=(process.stdout, channel.sendall), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    status = process.wait()
+    for thread in threads[1:]:
+        thread.join()
+    channel.send_exit_status(status)
+    channel.close()
+
+
+def set_file_attr(path, attr):
+    """paramiko.SFTPServer.set_file_attr, but a size change truncates in place instead of emptying the file"""
+    if attr._flags & attr.FLAG_PERMISSIONS:
+        os.chmod(path, attr.st_mode)
+    if attr._flags & attr.FLAG_UIDGID:
+        os.chown(path, attr.st_uid, attr.st_gid)
+    if attr._flags & attr.FLAG_AMTIME:
+        os.utime(path, (attr.st_atime, attr.st_mtime))
+    if attr._flags & attr.FLAG_SIZE:
+        os.truncate(path, attr.st_size)
+
+
+class StubSFTPHandle(paramiko.SFTPHandle):
+    def __init__(self, stats, flags=0):
+        super().__init__(flags)
+        self.stats = stats
+
+    def read(self, offset, length):
+        self.stats.count("sftp_requests")
+        return super().read(offset, length)
+
+    def write(self, offset, data):
+        self.stats.count("sftp_requests")
+        return super().write(offset, data)
+
+    def stat(self):
+        self.stats.count("sftp_requests")
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        self.stats.count("sftp_requests")
+        try:
+            set_file_attr(self.filename, attr)
+            return paramiko.SFTP_OK
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    """Serves the local filesystem as is, counting every request"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.stats = server.stats
+
+    def _call(self, function, *args):
+        self.stats.count("sftp_requests")
+        try:
+            result = function(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK if result is None else result
+
+    def list_folder(self, path):
+        def list_folder():
+            return [
+                paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name)
+                for name in os.listdir(path)
+            ]
+        return self._call(list_folder)
+
+    def stat(self, path):
+        return self._call(lambda: paramiko.SFTPAttributes.from_stat(os.stat(path)))
+
+    def lstat(self, path):
+        return self._call(lambda: paramiko.SFTPAttributes.from_stat(os.lstat(path)))
+
+    def open(self, path, flags, attr):
+        def open_file():
+            mode = getattr(attr, "st_mode", None) or 0o666
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), mode)
+            if flags & os.O_WRONLY:
+                fstr = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                fstr = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                fstr = "rb"
+            handle = StubSFTPHandle(self.stats, flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, fstr)
+            return handle
+        return self._call(open_file)
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        return self._call(set_file_attr, path, attr)
+
+
+class LocalSFTPServer:
+    """paramiko SSH server on localhost, one thread per connection"""
+
+    def __init__(self, stats, allow_exec=True):
+        self.stats = stats
+        self.allow_exec = allow_exec
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(32)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StubSFTPServer)
+            transport.start_server(server=StubServer(self.stats, self.allow_exec))
+
+
+class LinkEmulator:
+    """TCP proxy adding one-way latency and a bandwidth cap in both directions"""
+
+    def __init__(self, target_port, latency_ms, bandwidth_mbit):
+        self.target_port = target_port
+        self.delay = latency_ms / 2000.0  # Half the round trip each way
+        self.bytes_per_second = bandwidth_mbit * 1000 * 1000 / 8 if bandwidth_mbit else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(32)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            server = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.pipe(client, server)
+            self.pipe(server, client)
+
+    def pipe(self, source, destination):
+        # Bounded, so a full link pushes back on the sender like a real one
+        in_flight = queue.Queue(maxsize=256)
+        state = {"link_free_at": 0.0}
+
+        def read():
+            while True:
+                try:
+                    data = source.recv(65536)
+                except OSError:
+                    data = b""
+                now = time.monotonic()
+                if data and self.bytes_per_second:
+                    state["link_free_at"] = max(now, state["link_free_at"]) + len(data) / self.bytes_per_second
+                    deliver_at = state["link_free_at"] + self.delay
+                else:
+                    deliver_at = now + self.delay
+                in_flight.put((deliver_at, data))
+                if not data:
+                    return
+
+        def write():
+            while True:
+                deliver_at, data = in_flight.get()
+                wait = deliver_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    if not data:
+                        destination.shutdown(socket.SHUT_WR)
+                        return
+                    destination.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+
+def write_file(path, size, rng, text=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        if text:
+            line = b'<path d="M 0 0 L 10 10 Z" style="fill:#336699;stroke:#000000"/>\n'
+            f.write((line * (size // len(line) + 1))[:size])
+            return
+        remaining = size
+        while remaining:
+            chunk = min(remaining, 1024 * 1024)
+            f.write(rng.randbytes(chunk))
+            remaining -= chunk
+
+
+def build_tiny_files(local_dir, scale, rng):
+    for i in range(int(2000 * scale)):
+        write_file(os.path.join(local_dir, "tiles", str(i % 20), f"{i}.svg"), rng.randint(512, 4096), rng, text=True)
+
+
+def build_large_files(local_dir, scale, rng):
+    for i in range(2):
+        write_file(os.path.join(local_dir, "data", f"layer_{i}.gpkg"), int(64 * 1024 * 1024 * scale), rng)
+
+
+def build_deep_nesting(local_dir, scale, rng):
+    for i in range(int(200 * scale)):
+        parts = [f"level{depth}_{(i >> depth) % 2}" for depth in range(15)]
+        write_file(os.path.join(local_dir, *parts, f"file_{i}.qml"), rng.randint(1024, 8192), rng, text=True)
+
+
+def build_mixed(local_dir, scale, rng):
+    build_tiny_files(local_dir, scale / 4, rng)
+    build_large_files(local_dir, scale / 2, rng)
+    write_file(os.path.join(local_dir, "project.qgs"), 256 * 1024, rng, text=True)
+
+
+def edit_mixed(local_dir, rng):
+    """Typical work between two saves: a feature edit, a re-saved project, touched sidecars"""
+    later = time.time() + 5
+    for name in sorted(os.listdir(os.path.join(local_dir, "data"))):
+        path = os.path.join(local_dir, "data", name)
+        with open(path, "r+b") as f:
+            f.seek(os.path.getsize(path) // 2)
+            f.write(rng.randbytes(4096))
+        os.utime(path, (later, later))
+    project = os.path.join(local_dir, "project.qgs")
+    write_file(project, 260 * 1024, rng, text=True)
+    os.utime(project, (later, later))
+    tiles = os.path.join(local_dir, "tiles", "0")
+    for name in sorted(os.listdir(tiles))[:10]:
+        os.utime(os.path.join(tiles, name), (later, later))
+
+
+SCENARIOS = {
+    "tiny_files": (build_tiny_files, None),
+    "large_files": (build_large_files, None),
+    "deep_nesting": (build_deep_nesting, None),
+    "incremental_edit": (build_mixed, edit_mixed),
+}
+
+
+def mismatched_files(local_dir, remote_dir, relative_paths):
+    """Relative paths whose remote copy is missing or differs from the local file"""
+    mismatched = []
+    for relative_path in relative_paths:
+        try:
+            if filecmp.cmp(os.path.join(local_dir, relative_path), os.path.join(remote_dir, relative_path), shallow=False):
+                continue
+        except OSError:
+            pass
+        mismatched.append(relative_path)
+    return mismatched
+
+
+def run_job(server_info, local_dir, remote_path, path, stats):
+    """Time one sync the way the plugin runs it, from a cold connection"""
+    engine.connection_pool.close_all()
+    stats.reset()
+    job = engine.SFTPSyncJob(
+        server_info, local_dir, remote_path, "",
+        ask_overwrite=(lambda local_path: engine.OVERWRITE_NO) if path == "interactive" else None,
+        reconcile=path == "interactive",
+        log=lambda message: None,
+    )
+    start = time.perf_counter()
+    job.run()
+    wall = time.perf_counter() - start
+    if path == "auto":
+        relative_paths = [os.path.relpath(os.path.join(directory, name), local_dir)
+                          for directory, _, names in os.walk(local_dir) for name in names]
+    else:
+        # The dialog was told not to overwrite, only what it uploaded has to match
+        relative_paths = [os.path.relpath(remote_file, job.upload_root) for remote_file in job.uploaded]
+    mismatched = mismatched_files(local_dir, job.upload_root, relative_paths)
+    # A sync that broke files has no throughput worth comparing
+    valid = wall and not mismatched
+    return {
+        "wall_s": round(wall, 3),
+        "files_total": job.total_files,
+        "files_uploaded": len(job.uploaded),
+        "files_failed": len(job.failed),
+        "files_mismatched": len(mismatched),
+        "bytes_sent": job.bytes_sent,
+        "files_per_s": round(len(job.uploaded) / wall, 1) if valid else None,
+        "mb_per_s": round(job.bytes_sent / wall / 1024 / 1024, 2) if valid else None,
+        "sftp_requests": stats.sftp_requests,
+        "exec_commands": stats.exec_commands,
+    }
+
+
+def parse_setting(text):
+    key, _, value = text.partition("=")
+    if value.lower() in ("true", "false"):
+        return key, value.lower() == "true"
+    try:
+        return key, int(value)
+    except ValueError:
+        return key, value
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument("--path", action="append", choices=["auto", "interactive"], help="default: both")
+    parser.add_argument("--latency-ms", type=float, default=50, help="round trip time added by the link (default 50)")
+    parser.add_argument("--bandwidth-mbit", type=float, default=100, help="link bandwidth, 0 = unlimited (default 100)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies file counts and sizes (default 1)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="server setting, e.g. max_parallel=1")
+    parser.add_argument("--no-shell", action="store_true", help="refuse exec requests, SFTP only")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    stats = ServerStats()
+    server = LocalSFTPServer(stats, allow_exec=not args.no_shell)
+    link = LinkEmulator(server.port, args.latency_ms, args.bandwidth_mbit)
+    server_info = {"host": "127.0.0.1", "port": link.port, "username": USERNAME, "password": PASSWORD}
+    server_info.update(dict(parse_setting(setting) for setting in args.set))
+
+    work_dir = tempfile.mkdtemp(prefix="sftp-bench-")
+    engine.MANIFEST_DIR = os.path.join(work_dir, "manifests")
+    engine.HASH_CACHE_FILE = os.path.join(work_dir, "hashes.json")
+    runs = []
+    try:
+        for scenario in args.scenario or sorted(SCENARIOS):
+            build, edit = SCENARIOS[scenario]
+            for path in args.path or ["auto", "interactive"]:
+                for repeat in range(args.repeat):
+                    rng = random.Random(args.seed)
+                    run_dir = os.path.join(work_dir, f"{scenario}-{path}-{repeat}")
+                    local_dir = os.path.join(run_dir, "local")
+                    remote_path = os.path.join(run_dir, "remote")
+                    shutil.rmtree(engine.MANIFEST_DIR, ignore_errors=True)
+                    build(local_dir, args.scale, rng)
+                    if edit:
+                        run_job(server_info, local_dir, remote_path, path, stats)
+                        edit(local_dir, rng)
+                    result = run_job(server_info, local_dir, remote_path, path, stats)
+                    result.update({"scenario": scenario, "path": path, "repeat": repeat})
+                    runs.append(result)
+                    print(f"{scenario:18} {path:12} {result['wall_s']:8.2f}s {result['files_uploaded']:6} files "
+                          f"{result['mb_per_s'] or 0:8.2f} MB/s {result['sftp_requests']:7} requests {result['exec_commands']:4} commands")
+                    if result["files_mismatched"]:
+                        print(f"  {result['files_mismatched']} remote files differ from the local ones, no throughput reported",
+                              file=sys.stderr)
+                    shutil.rmtree(run_dir, ignore_errors=True)
+    finally:
+        engine.connection_pool.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "paramiko": paramiko.__version__,
+        "link": {"latency_ms": args.latency_ms, "bandwidth_mbit": args.bandwidth_mbit},
+        "scale": args.scale,
+        "shell": not args.no_shell,
+        "server_settings": {key: value for key, value in server_info.items() if key not in ("host", "port", "username", "password")},
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
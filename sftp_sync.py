@@ -0,0 +1,2431 @@
+"""SFTP sync engine of the AcuGIS SFTP plugin, usable without QGIS.
+
+Uploads local directories to remote paths on the servers configured in the
+plugin (~/.sftp_uploader_config.json), from scripts, cron jobs or CI:
+
+    python -m sftp_sync SERVER LOCAL_DIR REMOTE_PATH [LOCAL_DIR REMOTE_PATH ...]
+
+or, from the directory the plugin is installed in, python -m acugis_sftp_tool.
+Several directories given in one run share the server connection. From
+Python, use SFTPSyncJob directly; connection_pool keeps connections open
+between jobs of the same process.
+
+Only the standard library is imported up front, paramiko is loaded when
+the first connection is opened.
+"""
+import argparse
+import os
+import json
+import datetime
+import logging
+import functools
+import mmap
+import sys
+import time
+import posixpath
+import hashlib
+import queue
+import re
+import shlex
+import stat
+import tarfile
+import threading
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Progress and diagnostics; the job's log callback gets what the user should see
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".sftp_uploader_config.json")
+# What was last uploaded to each server and remote path, one JSON file each
+MANIFEST_DIR = os.path.join(os.path.expanduser("~"), ".sftp_uploader_manifests")
+# SHA-256 digests of local files, for checksum mode
+HASH_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".sftp_uploader_hashes.json")
+# Default location of the JSON sync reports, when they are turned on
+REPORT_DIR = os.path.join(os.path.expanduser("~"), ".sftp_uploader_reports")
+
+# Number of SFTP channels used side by side on one connection, per server
+DEFAULT_MAX_PARALLEL = 4
+
+# How much of a local file is read per write (KB), per server. Writes are
+# pipelined whatever the size; an upload is paced by the window the server
+# grants, which nothing on our side changes.
+DEFAULT_CHUNK_SIZE_KB = 1024
+# Server settings that need a new connection when they change
+CONNECTION_SETTINGS = ('password', 'compress', 'ciphers')
+
+# Adaptive mode, per server: parallel transfers and chunk size are tuned while
+# sending. Throughput is sampled every ADAPTIVE_INTERVAL seconds, a step up is
+# kept when it gained at least ADAPTIVE_GAIN.
+ADAPTIVE_INTERVAL = 2.0
+ADAPTIVE_GAIN = 1.1
+ADAPTIVE_MAX_PARALLEL = 8
+ADAPTIVE_CHUNK_STEP_KB = 256
+ADAPTIVE_MIN_CHUNK_KB = 64
+ADAPTIVE_MAX_CHUNK_KB = 8192
+# Samples a sync needs before what it learned is kept for the next one
+ADAPTIVE_MIN_SAMPLES = 3
+
+# Channels OpenSSH allows per connection by default (MaxSessions). One is kept
+# for remote commands; with per-file compression every parallel transfer needs
+# two, its SFTP channel and the gzip it streams into.
+SERVER_MAX_CHANNELS = 10
+
+# Seconds between SSH keep-alive packets, and before an unused pooled connection is closed
+KEEPALIVE_INTERVAL = 30
+IDLE_TIMEOUT = 300
+
+# Seconds a remote directory listing is reused by the remote path browser
+REMOTE_DIR_CACHE_TTL = 120
+# Files of at least this many MB are updated by sending only changed blocks, per server (0 = off)
+DEFAULT_DELTA_THRESHOLD_MB = 64
+DELTA_BLOCK_SIZE = 1024 * 1024
+# Fall back to a plain upload when more than this share of the blocks changed
+DELTA_MAX_CHANGED = 0.5
+
+# When at least BULK_MIN_FILES files smaller than BULK_MAX_FILE_SIZE bytes change,
+# they are sent as one tar stream instead of one by one, per server (can be turned off)
+BULK_MIN_FILES = 50
+BULK_MAX_FILE_SIZE = 256 * 1024
+
+# Per-file compression, per server: files of at least COMPRESS_MIN_SIZE bytes with
+# one of these extensions are sent gzip-compressed into a remote gzip -d, if
+# zlib shrinks samples from the start, middle and end to at most COMPRESS_MAX_RATIO.
+# Compressed formats (.qgz, JPEG, PNG, ...) are never tried; compressed GeoTIFFs
+# such as COGs fail the sample check.
+COMPRESSIBLE_EXTENSIONS = (".qgs", ".qml", ".sld", ".xml", ".gml", ".kml", ".gpx", ".osm", ".geojson", ".json",
+                           ".csv", ".txt", ".asc", ".xyz", ".svg", ".html", ".js", ".css", ".sql",
+                           ".shp", ".dbf", ".tif", ".tiff", ".gpkg", ".sqlite")
+COMPRESS_MIN_SIZE = 128 * 1024
+COMPRESS_SAMPLE_SIZE = 64 * 1024
+COMPRESS_MAX_RATIO = 0.7
+# zlib level: most of the gain on XML and CSV, fast enough not to slow down fast links
+COMPRESS_LEVEL = 3
+
+# Release mode, per server: every upload goes into a new directory next to the
+# remote path, which becomes a symlink switched to it in one rename. This many
+# releases are kept, including the live one (0 = upload in place)
+DEFAULT_KEEP_RELEASES = 0
+# Name of the release an in-place remote directory becomes when release mode is turned on
+IN_PLACE_RELEASE_SUFFIX = "-in-place"
+
+# Paths handed to one remote chown/sha256sum command, small enough that its
+# output can never fill the channel window while we are still writing the path list
+REMOTE_BATCH_SIZE = 1000
+
+# Never uploaded unless re-included with a "!" rule: version control, Python
+# caches, QGIS project backups, SQLite/GeoPackage journals and OS clutter
+DEFAULT_EXCLUDES = [
+    ".git/", ".svn/", ".hg/", "__pycache__/", "*.pyc",
+    "*.qgs~", "*.qgz~", "*.qgs.bak", "*.qgz.bak", "*.qgd-journal",
+    "*.gpkg-shm", "*.gpkg-wal", "*.gpkg-journal", "*.sqlite-shm", "*.sqlite-wal", "*.sqlite-journal", "*.db-journal",
+    ".DS_Store", "Thumbs.db", "desktop.ini", "*.tmp", "~$*",
+]
+
+# Answers to the "file exists" question asked during interactive uploads
+OVERWRITE_YES = "yes"
+OVERWRITE_NO = "no"
+OVERWRITE_YES_TO_ALL = "yes_to_all"
+OVERWRITE_NO_TO_ALL = "no_to_all"
+
+
+class UploadCanceled(Exception):
+    pass
+
+
+def load_config(path=CONFIG_FILE):
+    """The configured servers, server name -> server settings"""
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_config(config, path=CONFIG_FILE):
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def remember_tuning(server_info, learned, path=CONFIG_FILE):
+    """Store what an adaptive sync learned with every configured server it applies to"""
+    config = load_config(path)
+    key = SFTPConnectionPool.key(server_info)
+    changed = False
+    for entry in config.values():
+        try:
+            matches = SFTPConnectionPool.key(entry) == key
+        except (KeyError, TypeError, ValueError):
+            matches = False
+        if matches and entry.get('learned') != learned:
+            entry['learned'] = learned
+            changed = True
+    if changed:
+        save_config(config, path)
+
+
+def server_setting(server_info, key, default):
+    """A non-negative integer setting of a server, default if missing or invalid"""
+    try:
+        return max(0, int(server_info.get(key, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+@functools.lru_cache(maxsize=None)
+def counting_sftp_client():
+    """The SFTPClient subclass that counts every request it sends on the session it belongs to.
+
+    Defined on first use, so importing this module does not load paramiko.
+    """
+    import paramiko
+
+    class CountingSFTPClient(paramiko.SFTPClient):
+        session = None
+
+        def _async_request(self, *args, **kwargs):
+            if self.session is not None:
+                self.session.count('sftp_requests')
+            return super()._async_request(*args, **kwargs)
+
+    return CountingSFTPClient
+
+
+class TokenBucket:
+    """Limits the bytes sent per second, shared by every channel of a connection.
+
+    take(size) returns right away while tokens are left, otherwise it
+    sleeps until the rate has paid off the debt, so concurrent senders
+    together stay below rate. At most one second of unused rate is saved
+    up for bursts. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            if rate != self.rate:
+                self.rate = rate
+                self.tokens = min(self.tokens, rate)
+
+    def take(self, size):
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - size
+            self.updated = now
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThrottledWriter:
+    """Write-only file object that passes every write through throttle(size) first"""
+
+    def __init__(self, f, throttle):
+        self.f = f
+        self.throttle = throttle
+
+    def write(self, data):
+        self.throttle(len(data))
+        return self.f.write(data)
+
+
+class AdaptiveTuner:
+    """AIMD tuning of the parallel transfers and the chunk size of one sync.
+
+    The bytes sent are sampled every ADAPTIVE_INTERVAL seconds. While the
+    throughput keeps improving by ADAPTIVE_GAIN, one more parallel transfer
+    and a larger chunk are tried in turn (additive increase); a step that
+    does not pay off is taken back and the tuner holds until throughput
+    improves again. A transfer that fails on the connection halves both
+    (multiplicative decrease) and probing starts over.
+    """
+
+    def __init__(self, streams, chunk_size, max_streams=ADAPTIVE_MAX_PARALLEL):
+        self.max_streams = max_streams
+        self.streams = max(1, min(streams, max_streams))
+        self.chunk_size = max(ADAPTIVE_MIN_CHUNK_KB, min(chunk_size // 1024, ADAPTIVE_MAX_CHUNK_KB)) * 1024
+        self.samples = 0
+        self.best_rate = 0.0
+        self.last_step = None
+        self._next_step = "streams"
+        self._sent = 0
+        self._sample_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def sent(self, size):
+        """Count bytes put on the wire, adjusting once per interval"""
+        with self._lock:
+            self._sent += size
+            now = time.monotonic()
+            elapsed = now - self._sample_time
+            if elapsed < ADAPTIVE_INTERVAL:
+                return
+            rate = self._sent / elapsed
+            self._sent, self._sample_time = 0, now
+            self.samples += 1
+            if rate >= self.best_rate * ADAPTIVE_GAIN:
+                self.best_rate = rate
+                self._increase()
+            elif self.last_step is not None:
+                self._undo()
+
+    def _increase(self):
+        steps = ("streams", "chunk") if self._next_step == "streams" else ("chunk", "streams")
+        for step in steps:
+            if step == "streams" and self.streams < self.max_streams:
+                self.streams += 1
+            elif step == "chunk" and self.chunk_size + ADAPTIVE_CHUNK_STEP_KB * 1024 <= ADAPTIVE_MAX_CHUNK_KB * 1024:
+                self.chunk_size += ADAPTIVE_CHUNK_STEP_KB * 1024
+            else:
+                continue
+            self.last_step = step
+            self._next_step = "chunk" if step == "streams" else "streams"
+            return
+        self.last_step = None
+
+    def _undo(self):
+        if self.last_step == "streams":
+            self.streams -= 1
+        elif self.last_step == "chunk":
+            self.chunk_size -= ADAPTIVE_CHUNK_STEP_KB * 1024
+        self.last_step = None
+
+    def error(self):
+        with self._lock:
+            self.streams = max(1, self.streams // 2)
+            self.chunk_size = max(ADAPTIVE_MIN_CHUNK_KB * 1024, self.chunk_size // 2)
+            self.best_rate = 0.0
+            self.last_step = None
+
+    def limit_streams(self, streams):
+        """The server refused more channels than streams"""
+        with self._lock:
+            self.max_streams = self.streams = max(1, streams)
+            self.last_step = None
+
+    def learned(self):
+        """Settings for the next sync to start from, None after too few samples"""
+        with self._lock:
+            if self.samples < ADAPTIVE_MIN_SAMPLES:
+                return None
+            return {"max_parallel": self.streams, "chunk_size": self.chunk_size // 1024}
+
+
+class SFTPSession:
+    """One authenticated SSH transport to a server.
+
+    SFTP channels and exec_command channels are all opened on the same
+    transport, so an upload costs a single key exchange and login. All
+    uploads on it share one bandwidth limit.
+    """
+
+    def __init__(self, server_info):
+        self.server_info = dict(server_info)
+        self.transport = None
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.connected_at = None
+        # Replaced in the pool while in use, closed when the last user releases it
+        self.retired = False
+        self.bandwidth = TokenBucket()
+        # Running totals for sync reports: sftp_requests, remote_commands, reconnects
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.connect()
+
+    def connect(self):
+        import paramiko
+
+        server_info = self.server_info
+        transport = paramiko.Transport((server_info['host'], server_info['port']))
+        try:
+            transport.use_compression(bool(server_info.get('compress', False)))
+            preferred = [cipher.strip() for cipher in server_info.get('ciphers', '').split(',') if cipher.strip()]
+            if preferred:
+                # Try the preferred ciphers first, unknown names are ignored
+                options = transport.get_security_options()
+                supported = list(options.ciphers)
+                preferred = [cipher for cipher in preferred if cipher in supported]
+                options.ciphers = tuple(preferred + [cipher for cipher in supported if cipher not in preferred])
+            transport.set_keepalive(KEEPALIVE_INTERVAL)
+            transport.connect(username=server_info['username'], password=server_info['password'])
+        except Exception:
+            transport.close()
+            raise
+        self.transport = transport
+        self.connected_at = time.monotonic()
+
+    def reconnect(self, stale_transport):
+        """Replace a transport that failed, unless another thread already did"""
+        with self._lock:
+            if self.transport is stale_transport:
+                self.count('reconnects')
+                self.close()
+                self.connect()
+
+    def reconnect_if_dead(self, transport):
+        """After a failed channel open: reconnect if transport dropped, otherwise re-raise.
+
+        A live transport means the server refused the channel, e.g. past
+        its MaxSessions; the channels other threads have open on it are
+        fine, and the caller has to make do with fewer.
+        """
+        if transport is not None and transport.is_active():
+            raise
+        self.reconnect(transport)
+
+    def count(self, name):
+        with self._counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._counters_lock:
+            return dict(self.counters)
+
+    def is_alive(self):
+        return self.transport is not None and self.transport.is_active() and self.transport.is_authenticated()
+
+    def open_sftp(self):
+        """Open a new SFTP channel, reconnecting once if the transport went stale"""
+        import paramiko
+
+        client_class = counting_sftp_client()
+        transport = self.transport
+        try:
+            sftp = client_class.from_transport(transport)
+        except (paramiko.SSHException, EOFError, OSError):
+            self.reconnect_if_dead(transport)
+            sftp = client_class.from_transport(self.transport)
+        if sftp is None:
+            raise paramiko.SSHException("The server did not open an SFTP channel")
+        sftp.session = self
+        return sftp
+
+    def exec_command(self, command):
+        """Run a remote command, returns (stdin, stdout, stderr) like SSHClient.exec_command"""
+        import paramiko
+
+        transport = self.transport
+        try:
+            channel = transport.open_session()
+        except (paramiko.SSHException, EOFError, OSError):
+            self.reconnect_if_dead(transport)
+            channel = self.transport.open_session()
+        self.count('remote_commands')
+        channel.exec_command(command)
+        return channel.makefile_stdin("wb"), channel.makefile("r"), channel.makefile_stderr("r")
+
+    def exec_with_input(self, command, data):
+        """Run a remote command with data on its stdin, returns (exit status, stdout, stderr)"""
+        stdin, stdout, stderr = self.exec_command(command)
+        stdin.write(data)
+        stdin.flush()
+        stdin.channel.shutdown_write()
+        output = stdout.read()
+        errors = stderr.read()
+        return stdout.channel.recv_exit_status(), output, errors
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class SFTPConnectionPool:
+    """Keeps one SFTPSession per server, shared by uploads, browsing and connection tests.
+
+    Sessions stay open between operations so repeated auto-uploads start
+    transferring right away. Sessions nobody used for IDLE_TIMEOUT seconds
+    are closed by evict_idle().
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._connect_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(server_info):
+        return (server_info['host'], int(server_info['port']), server_info['username'])
+
+    @contextmanager
+    def session(self, server_info):
+        """Borrow the session for server_info, connecting or reconnecting as needed"""
+        session = self.acquire(server_info)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def acquire(self, server_info):
+        key = self.key(server_info)
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+
+        # Connect outside the pool lock so a slow server does not hold up the others
+        with connect_lock:
+            with self._lock:
+                session = self._sessions.get(key)
+            changed = any(session.server_info.get(setting) != server_info.get(setting) for setting in CONNECTION_SETTINGS) if session else False
+            if session is not None and (changed or not session.is_alive()):
+                with self._lock:
+                    if session.users == 0:
+                        session.close()
+                    else:
+                        session.retired = True
+                session = None
+            if session is None:
+                session = SFTPSession(server_info)
+            with self._lock:
+                self._sessions[key] = session
+                session.users += 1
+                session.last_used = time.monotonic()
+        return session
+
+    def release(self, session):
+        with self._lock:
+            session.users -= 1
+            session.last_used = time.monotonic()
+            if session.retired and session.users == 0:
+                session.close()
+
+    def evict_idle(self):
+        """Close sessions that are unused and idle, or whose connection dropped"""
+        now = time.monotonic()
+        with self._lock:
+            for key, session in list(self._sessions.items()):
+                if session.users == 0 and (now - session.last_used > self.idle_timeout or not session.is_alive()):
+                    session.close()
+                    del self._sessions[key]
+
+    def close_all(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+connection_pool = SFTPConnectionPool()
+
+
+def list_remote_dirs(sftp, path):
+    """Sorted names of the subdirectories of a remote directory, symlinks to directories included"""
+    dirs = []
+    for entry in sftp.listdir_attr(path):
+        mode = entry.st_mode or 0
+        if stat.S_ISLNK(mode):
+            try:
+                mode = sftp.stat(posixpath.join(path, entry.filename)).st_mode
+            except IOError:
+                continue  # Dangling link
+        if stat.S_ISDIR(mode):
+            dirs.append(entry.filename)
+    return sorted(dirs)
+
+
+class RemoteDirectoryCache:
+    """Subdirectory names of remote directories per server, reused for ttl seconds.
+
+    Filled by the remote path browser, so reopening it shows the tree
+    right away. Uploads forget the parts of the tree they create
+    directories in.
+    """
+
+    def __init__(self, ttl=REMOTE_DIR_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_info, path):
+        """The cached subdirectory names of path, None if unknown or expired"""
+        with self._lock:
+            entry = self._entries.get((SFTPConnectionPool.key(server_info), path))
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def put(self, server_info, path, dirs):
+        with self._lock:
+            self._entries[(SFTPConnectionPool.key(server_info), path)] = (time.monotonic(), dirs)
+
+    def invalidate(self, server_info, path="/"):
+        """Forget path and everything below it"""
+        key = SFTPConnectionPool.key(server_info)
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            for cached in list(self._entries):
+                if cached[0] == key and (cached[1] == path or cached[1].startswith(prefix)):
+                    del self._entries[cached]
+
+
+remote_dir_cache = RemoteDirectoryCache()
+
+
+class SyncManifest:
+    """What was last uploaded from a local directory to one server and remote path.
+
+    Maps relative path -> {"size": ..., "mtime": ...} of the local file at
+    the time it was uploaded, plus "sha256" in checksum mode. Uploaded files get their remote mtime set to
+    the local one, so an entry describes both copies until either changes
+    and clock differences between the machines don't matter.
+    """
+
+    def __init__(self, server_info, remote_path):
+        self.remote_path = remote_path.rstrip('/') or '/'
+        self.server = f"{server_info['username']}@{server_info['host']}:{server_info['port']}"
+        key = f"{self.server}:{self.remote_path}"
+        self.path = os.path.join(MANIFEST_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+        self.files = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.files = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            data = {"server": self.server, "remote_path": self.remote_path, "files": self.files}
+            with open(temp_path, 'w') as f:
+                json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def get(self, relative_path):
+        return self.files.get(relative_path)
+
+    def record(self, relative_path, size, mtime, sha256=None, blocks=None):
+        entry = {"size": size, "mtime": mtime}
+        if sha256:
+            entry["sha256"] = sha256
+        if blocks:
+            # Per-block digests for delta transfers of large files
+            entry["block_size"] = DELTA_BLOCK_SIZE
+            entry["blocks"] = blocks
+        with self._lock:
+            self.files[relative_path] = entry
+        return entry
+
+    def retain(self, relative_paths, within=None):
+        """Forget files that no longer exist locally.
+
+        With within, a set of relative directories, only files directly in
+        those directories are considered, the others are kept as they are.
+        """
+        with self._lock:
+            self.files = {
+                path: entry for path, entry in self.files.items()
+                if path in relative_paths or (within is not None and posixpath.dirname(path) not in within)
+            }
+
+    def clear(self):
+        with self._lock:
+            self.files = {}
+
+    @staticmethod
+    def matches(entry, size, mtime):
+        return entry is not None and entry["size"] == size and entry["mtime"] == mtime
+
+
+class SyncJournal:
+    """Append-only record of the batch being uploaded, kept next to the manifest.
+
+    The first line lists the files of the batch with the size and mtime
+    they had, then one line is appended per finished file with its
+    manifest entry. When a sync is interrupted - canceled, disconnected or
+    QGIS crashed before the manifest was saved - the next sync recovers
+    the finished files into the manifest and resumes the partial uploads
+    of the pending ones, as long as the local file did not change since.
+    """
+
+    def __init__(self, manifest):
+        self.path = os.path.splitext(manifest.path)[0] + ".journal"
+        self._file = None
+        self._lock = threading.Lock()
+
+    def recover(self):
+        """Return ({relative path: [size, mtime]} still pending, {relative path: entry} finished)"""
+        pending = {}
+        done = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Torn last line of a crash
+                    if "batch" in record:
+                        pending = {relative_path: [size, mtime] for relative_path, size, mtime in record["batch"]}
+                    elif "done" in record:
+                        done[record["done"]] = record["entry"]
+        except OSError:
+            pass
+        for relative_path in done:
+            pending.pop(relative_path, None)
+        return pending, done
+
+    def start(self, local_files):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'w')
+        batch = [[local_file.relative_path, local_file.size, local_file.mtime] for local_file in local_files]
+        self._write({"batch": batch})
+
+    def finished(self, relative_path, entry):
+        self._write({"done": relative_path, "entry": entry})
+
+    def _write(self, record):
+        with self._lock:
+            if self._file is None:
+                return  # Not started: a release is discarded rather than resumed, see SFTPSyncJob.stage_release
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self, complete):
+        """Close the journal, removing it when the whole batch was uploaded"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        if complete and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SyncReport:
+    """Where the time of one sync went, saved as a JSON file per sync.
+
+    Phases are timed with phase(); time spent waiting for the user to
+    answer overwrite questions is not part of any phase. Request and
+    command counts are taken from the session, so syncs running at the
+    same time to the same server count each other's requests too.
+    """
+
+    def __init__(self, server_info, local_dir, remote_path):
+        self.server = f"{server_info['username']}@{server_info['host']}:{server_info['port']}"
+        self.local_dir = local_dir
+        self.remote_path = remote_path
+        self.started = time.time()
+        self.phases = {}
+        self.counters = {}
+        self.data = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self, job, status, session_counters, connection_reused):
+        transfer_time = self.phases.get("transfer", 0.0)
+        self.data = {
+            "server": self.server,
+            "local_dir": self.local_dir,
+            "remote_path": self.remote_path,
+            "started": datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).isoformat(),
+            "duration_s": round(time.time() - self.started, 3),
+            "status": status,
+            "connection_reused": connection_reused,
+            "phases_s": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "files": {
+                "total": job.total_files,
+                "selected": self.counters.get("files_selected", 0),
+                "uploaded": len(job.uploaded),
+                "failed": len(job.failed),
+                "interrupted": self.counters.get("files_interrupted", 0),
+            },
+            "bytes_sent": job.bytes_sent,
+            "throughput_mb_s": round(job.bytes_sent / transfer_time / 1024 / 1024, 2) if transfer_time else None,
+            "sftp_requests": session_counters.get("sftp_requests", 0),
+            "remote_commands": session_counters.get("remote_commands", 0),
+            "reconnects": session_counters.get("reconnects", 0),
+            "retries": session_counters.get("reconnects", 0) + self.counters.get("fallbacks", 0),
+            "tuning": job.tuning(),
+            "counters": dict(self.counters),
+        }
+
+    def save(self, directory):
+        """Write the report to directory, returns its path"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        # Syncs of other remote paths, users or ports of the server can finish in the same second
+        target = hashlib.sha1(f"{self.server}:{self.remote_path}".encode("utf-8")).hexdigest()[:8]
+        server = re.sub(r'[^\w.@-]', '_', self.server)
+        name = f"sftp-sync-{stamp}-{server}-{target}"
+        suffix = ""
+        while True:
+            path = os.path.join(directory, f"{name}{suffix}.json")
+            try:
+                with open(path, 'x') as f:
+                    json.dump(self.data, f, indent=2)
+                return path
+            except FileExistsError:
+                suffix = f"-{int(suffix[1:] or 1) + 1}"
+
+    def summary(self):
+        """One line of phase timings and throughput, for the message bar"""
+        parts = [f"{name.replace('_', ' ')} {seconds:.1f}s" for name, seconds in self.data.get("phases_s", {}).items() if seconds >= 0.05]
+        if self.data.get("throughput_mb_s"):
+            parts.append(f"{self.data['throughput_mb_s']} MB/s")
+        parts.append(f"{self.data.get('sftp_requests', 0)} requests")
+        return ", ".join(parts)
+
+
+class SyncRules:
+    """gitignore-style rules deciding which local files are uploaded.
+
+    One pattern per line, the last matching pattern decides. "!" in front
+    re-includes what an earlier pattern excluded, a trailing "/" matches
+    directories only. Patterns containing a "/" are relative to the local
+    directory, others match a name at any depth. "*" and "?" do not match
+    "/", "**" does. Blank lines and lines starting with "#" are ignored.
+
+    As with git, files in an excluded directory can't be re-included; the
+    local walk doesn't descend into excluded directories at all.
+    """
+
+    def __init__(self, patterns):
+        self.rules = []
+        for line in patterns:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+            regex = self.translate(line)
+            regex = f"^{regex}$" if anchored else f"^(?:.*/)?{regex}$"
+            self.rules.append((re.compile(regex), negate, dir_only))
+
+    @staticmethod
+    def translate(pattern):
+        parts = []
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                parts.append("(?:.*/)?")
+                i += 3
+            elif pattern.startswith("**", i):
+                parts.append(".*")
+                i += 2
+            elif pattern[i] == "*":
+                parts.append("[^/]*")
+                i += 1
+            elif pattern[i] == "?":
+                parts.append("[^/]")
+                i += 1
+            elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+                end = pattern.index("]", i + 1)
+                chars = pattern[i + 1:end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                parts.append(f"[{chars}]")
+                i = end + 1
+            else:
+                parts.append(re.escape(pattern[i]))
+                i += 1
+        return "".join(parts)
+
+    def excluded(self, relative_path, is_dir=False):
+        """Whether the rules exclude relative_path itself, its parents are not checked"""
+        result = False
+        for regex, negate, dir_only in self.rules:
+            if (is_dir or not dir_only) and regex.match(relative_path):
+                result = not negate
+        return result
+
+    def excluded_path(self, relative_path, is_dir=False):
+        """Whether relative_path or any of its parent directories is excluded"""
+        parts = relative_path.split("/")
+        for depth in range(1, len(parts)):
+            if self.excluded("/".join(parts[:depth]), True):
+                return True
+        return self.excluded(relative_path, is_dir)
+
+    @classmethod
+    def for_sync(cls, server_info, project_rules=""):
+        """The built-in excludes, then the server's rules, then the project's"""
+        return cls(DEFAULT_EXCLUDES + server_info.get('rules', '').splitlines() + (project_rules or '').splitlines())
+
+
+# A file below the local directory, with the stat values change detection uses
+LocalFile = namedtuple("LocalFile", "local_path relative_path remote_path size mtime")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def block_sha256(path, block_size=DELTA_BLOCK_SIZE):
+    """SHA-256 of every block_size block of a file, as a list of hex digests"""
+    digests = []
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digests.append(hashlib.sha256(block).hexdigest())
+    return digests
+
+
+class LocalHashCache:
+    """SHA-256 digests of local files, reused while inode, size and mtime are unchanged.
+
+    Files are hashed on a thread pool; hashlib releases the GIL while
+    hashing, so this keeps all cores busy without the process pool a QGIS
+    plugin cannot safely start.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or HASH_CACHE_FILE
+        self.entries = {}
+        self._file_locks = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def digests(self, local_paths):
+        """Return local path -> hex digest, None for files that can't be read"""
+        result = {}
+        to_hash = []
+        for local_path in local_paths:
+            try:
+                st = os.stat(local_path)
+            except OSError:
+                result[local_path] = None
+                continue
+            key = [st.st_ino, st.st_size, st.st_mtime]
+            cached = self.entries.get(local_path)
+            if cached and cached[:3] == key:
+                result[local_path] = cached[3]
+            else:
+                to_hash.append((local_path, key))
+
+        def hash_one(item):
+            local_path, key = item
+            # Jobs sharing the cache hash a file once, the others wait for its digest
+            with self._lock:
+                file_lock = self._file_locks.setdefault(local_path, threading.Lock())
+            with file_lock:
+                cached = self.entries.get(local_path)
+                if cached and cached[:3] == key:
+                    return local_path, cached[3]
+                try:
+                    digest = file_sha256(local_path)
+                except OSError:
+                    return local_path, None
+                with self._lock:
+                    self.entries[local_path] = key + [digest]
+                return local_path, digest
+
+        if to_hash:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+                for local_path, digest in pool.map(hash_one, to_hash):
+                    result[local_path] = digest
+        return result
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            with open(temp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.path)
+
+
+def walk_local_dir(local_dir, rules):
+    """Walk local_dir, not descending into directories the rules exclude.
+
+    Returns ([(local path, relative path, size, mtime)], {relative
+    directories}) with "/" separated relative paths; size and mtime are
+    None for files that could not be stat'ed.
+    """
+    entries = []
+    relative_dirs = set()
+    for root, dirs, files in os.walk(local_dir):
+        relative_dir = os.path.relpath(root, local_dir).replace("\\", "/")
+        if relative_dir == ".":
+            relative_dir = ""
+        else:
+            relative_dirs.add(relative_dir)
+        prefix = f"{relative_dir}/" if relative_dir else ""
+        # Prune excluded directories in place so os.walk skips them
+        dirs[:] = [d for d in dirs if not rules.excluded(prefix + d, True)]
+        for file in files:
+            relative_path = prefix + file
+            if rules.excluded(relative_path):
+                continue
+            local_path = os.path.join(root, file)
+            try:
+                st = os.stat(local_path)
+                size, mtime = st.st_size, st.st_mtime
+            except OSError:
+                size, mtime = None, None
+            entries.append((local_path, relative_path, size, mtime))
+    return entries, relative_dirs
+
+
+class LocalScan:
+    """The local side of a sync, shared by the jobs uploading it to several servers.
+
+    The first job that needs the listing walks the directory, the others
+    wait for and reuse it. File digests - whole-file SHA-256 in checksum
+    mode and the block digests of delta transfers - are computed once per
+    file too. File contents are memory-mapped by each job, so concurrent
+    uploads of a file share its pages in the OS cache instead of reading
+    it from disk once per server.
+
+    Only the built-in and the project's rules prune the shared walk, each
+    job drops what its server's rules exclude from the result.
+    """
+
+    def __init__(self, local_dir, project_rules=""):
+        self.local_dir = local_dir
+        self.rules = SyncRules.for_sync({}, project_rules)
+        self.hash_cache = LocalHashCache()
+        self._listing = None
+        self._blocks = {}
+        self._block_locks = {}
+        self._lock = threading.Lock()
+
+    def listing(self):
+        with self._lock:
+            if self._listing is None:
+                self._listing = walk_local_dir(self.local_dir, self.rules)
+            return self._listing
+
+    def block_digests(self, local_file):
+        key = (local_file.local_path, local_file.size, local_file.mtime)
+        with self._lock:
+            file_lock = self._block_locks.setdefault(key, threading.Lock())
+        with file_lock:
+            if key not in self._blocks:
+                self._blocks[key] = block_sha256(local_file.local_path)
+            return self._blocks[key]
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class TransferMeter:
+    """Bytes done of a batch, with a smoothed throughput and the time left.
+
+    The rate is sampled every interval seconds and smoothed exponentially,
+    so the estimate follows real changes in speed without jumping around
+    with every file.
+    """
+
+    def __init__(self, total=0, interval=0.5, smoothing=0.3):
+        self.total = total
+        self.done = 0
+        self.rate = None
+        self.interval = interval
+        self.smoothing = smoothing
+        self._sample_time = time.monotonic()
+        self._sample_done = 0
+
+    def update(self, done):
+        """Record the bytes done so far, returns True when a new rate sample was taken"""
+        self.done = done
+        now = time.monotonic()
+        elapsed = now - self._sample_time
+        if elapsed < self.interval:
+            return False
+        rate = max(0.0, (done - self._sample_done) / elapsed)
+        self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        self._sample_time, self._sample_done = now, done
+        return True
+
+    def percent(self):
+        return 100.0 * self.done / self.total if self.total else 100.0
+
+    def eta(self):
+        """Seconds left at the current rate, None while unknown"""
+        if not self.rate:
+            return None
+        return max(0, self.total - self.done) / self.rate
+
+    def text(self, current_file=None):
+        parts = [f"{format_bytes(self.done)} of {format_bytes(self.total)}"]
+        if self.rate is not None:
+            parts.append(f"{format_bytes(self.rate)}/s")
+        eta = self.eta()
+        if eta is not None:
+            parts.append(f"{format_duration(eta)} left")
+        if current_file:
+            parts.append(current_file)
+        return " · ".join(parts)
+
+
+class SFTPSyncJob:
+    """Uploads a local directory to a remote path.
+
+    Has no GUI dependencies so it can run inside a QgsTask worker thread or
+    from the command line, see main(). The caller is informed through plain callbacks:
+
+    - log(message): one line per uploaded/failed file
+    - progress(percent): overall progress by bytes, 0-100
+    - status(text): bytes done, throughput, time left and the current file,
+      at most twice a second
+    - is_canceled(): return True to stop after the current file
+    - wait_if_paused(): blocks while the user has paused the upload
+    - ask_overwrite(local_path): called for files that are not newer than the
+      remote copy; returns one of the OVERWRITE_* answers. When not given,
+      such files are skipped silently (auto-upload behaviour).
+
+    Changes are detected against the SyncManifest of the previous upload.
+    With reconcile=False and an existing manifest, the remote side is not
+    listed at all; otherwise the remote files are listed and compared too.
+    In checksum mode, files that only look changed are hashed and skipped
+    when their content is the same, and uploads are verified by hash.
+
+    Every sync is timed phase by phase in a SyncReport, which is written
+    to report_dir when one is given.
+
+    dirty, a (directories, files) pair of local paths as collected by a
+    ProjectWatcher, limits the local scan to the files directly in those
+    directories plus those files. It is only used when the manifest alone
+    is trusted; otherwise, and with dirty=None, the whole local directory
+    is walked. files, a list of local paths below local_dir, replaces the
+    walk altogether: only those files are uploaded, as when publishing
+    just what a project's layers use.
+
+    Files excluded by the SyncRules - built-in, the server's and the
+    project's rules given as rules - are left out, excluded directories
+    are not even walked.
+
+    Jobs uploading the same directory to several servers at once share a
+    LocalScan, given as scan.
+
+    Uploads can be capped at the server's 'bandwidth_limit' (KB/s), and
+    with its 'adaptive' setting the parallel transfers and chunk size are
+    tuned by an AdaptiveTuner; the caller can keep learned_tuning() for
+    the next sync, see remember_tuning().
+
+    With the server's 'compress_files' setting, compressible files are
+    sent gzip-compressed, see compressed_put.
+
+    With the server's 'releases' setting, changed files are uploaded into a
+    new release directory instead of the live remote path, which is switched
+    over to it atomically once every file arrived, see stage_release.
+    """
+
+    def __init__(self, server_info, local_dir, remote_path, ownership_value,
+                 ask_overwrite=None, log=print, progress=None, is_canceled=None, wait_if_paused=None,
+                 reconcile=False, checksum=None, report_dir=None, status=None, dirty=None, rules="", files=None,
+                 scan=None):
+        self.server_info = server_info
+        self.local_dir = local_dir
+        self.remote_path = remote_path
+        self.ownership_value = ownership_value
+        self.ask_overwrite = ask_overwrite
+        self.log = log
+        self.progress = progress or (lambda percent: None)
+        self.status = status or (lambda text: None)
+        self.is_canceled = is_canceled or (lambda: False)
+        self.wait_if_paused = wait_if_paused or (lambda: None)
+        self.reconcile = reconcile
+        self.dirty = dirty
+        self.files = files
+        self.rules = SyncRules.for_sync(server_info, rules)
+        self.manifest = SyncManifest(server_info, remote_path)
+        self.journal = SyncJournal(self.manifest)
+        # Whether this sync walked the whole local directory
+        self.full_walk = True
+        # Set once the changed files are known and uploading begins
+        self.transfer_started = False
+        self.report = SyncReport(server_info, local_dir, remote_path)
+        self.report_dir = report_dir
+        # Files left pending by an interrupted sync, relative path -> [size, mtime]
+        self.resumable = {}
+        # Checksum mode: skip files whose content did not change, verify uploads
+        self.checksum = server_info.get('checksum', False) if checksum is None else checksum
+        self.scan = scan
+        self.hash_cache = (scan.hash_cache if scan else LocalHashCache()) if self.checksum else None
+        self.delta_threshold = self.server_setting('delta_threshold', DEFAULT_DELTA_THRESHOLD_MB) * 1024 * 1024
+        self.chunk_size = max(32, self.server_setting('chunk_size', DEFAULT_CHUNK_SIZE_KB)) * 1024
+        # Per-file compression, turned off for the rest of the sync if the server can't decompress
+        self.compress_files = bool(server_info.get('compress_files', False))
+        self.tuner = None
+        if server_info.get('adaptive'):
+            learned = server_info.get('learned') or {}
+            self.tuner = AdaptiveTuner(server_setting(learned, 'max_parallel', self.max_parallel()),
+                                       server_setting(learned, 'chunk_size', self.chunk_size // 1024) * 1024,
+                                       min(ADAPTIVE_MAX_PARALLEL, self.max_streams()))
+        # The TokenBucket of the connection, once connected
+        self.bandwidth = None
+        self.keep_releases = self.server_setting('releases', DEFAULT_KEEP_RELEASES)
+        # Where files are uploaded to: remote_path, or the release being staged
+        self.upload_root = remote_path
+        self.release = None
+        # The manifest before a staged release, restored when it is not activated
+        self._manifest_before = None
+        # Local path -> SHA-256, checksum mode only
+        self.local_digests = {}
+
+        self.total_files = 0
+        # Local subdirectories relative to local_dir, "/" separated
+        self.local_dirs = set()
+        self.uploaded = []
+        self.failed = []
+        self.ownership_errors = []
+
+        self.bytes_sent = 0
+        # Bytes of the selected files done so far, drives progress and status
+        self.meter = TransferMeter()
+        self.current_file = None
+
+        self._lock = threading.Lock()
+        self._done = 0
+        # Remote directories known to exist during this sync
+        self._known_dirs = set()
+        # Uploaded files and created directories, chowned in batches at the end
+        self._chown_paths = []
+
+    def run(self):
+        started = time.monotonic()
+        with self.report.phase("connect"):
+            session = connection_pool.acquire(self.server_info)
+        status = "failed"
+        try:
+            self.bandwidth = session.bandwidth
+            self.bandwidth.set_rate(self.server_setting('bandwidth_limit', 0) * 1024)
+            # A pooled connection opened by an earlier operation
+            connection_reused = session.connected_at < started
+            counters_before = session.snapshot()
+            with self.report.phase("connect"):
+                sftp = session.open_sftp()
+            try:
+                self.sync(session, sftp)
+                status = "canceled" if self.is_canceled() else "completed"
+            except Exception as e:
+                status = f"failed: {e}"
+                raise
+            finally:
+                sftp.close()
+                self.manifest.save()
+                if self.hash_cache:
+                    self.hash_cache.save()
+                counters_after = session.snapshot()
+                session_counters = {name: counters_after[name] - counters_before.get(name, 0) for name in counters_after}
+                self.report.finish(self, status, session_counters, connection_reused)
+                self.save_report()
+        finally:
+            connection_pool.release(session)
+
+    def learned_tuning(self):
+        """What the AdaptiveTuner settled on, None when not adaptive or too little was sent"""
+        return self.tuner.learned() if self.tuner else None
+
+    def tuning(self):
+        """Transfer settings in effect, for the sync report"""
+        return {
+            "adaptive": self.tuner is not None,
+            "max_parallel": self.tuner.streams if self.tuner else self.max_parallel(),
+            "chunk_size_kb": self.current_chunk_size() // 1024,
+            "bandwidth_limit_kb_s": self.server_setting('bandwidth_limit', 0),
+        }
+
+    def save_report(self):
+        if not self.report_dir:
+            return
+        try:
+            path = self.report.save(self.report_dir)
+            logger.info(f"Sync report written to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write sync report: {e}")
+
+    def sync(self, session, sftp):
+        self.full_walk = self.files is None and (self.dirty is None or self.reconcile or not self.manifest.files)
+        with self.report.phase("local_walk"):
+            if self.files is not None:
+                all_files = self.list_project_files(self.files)
+                scanned_dirs = set()
+            elif self.full_walk:
+                all_files = self.list_local_files()
+                scanned_dirs = None
+            else:
+                dirty_dirs, dirty_files = self.dirty
+                # Files an interrupted batch left pending are checked again, so their partial uploads resume
+                pending, _ = self.journal.recover()
+                dirty_files = set(dirty_files) | {os.path.join(self.local_dir, *relative_path.split("/")) for relative_path in pending}
+                all_files, scanned_dirs = self.list_dirty_files(dirty_dirs, dirty_files)
+        with self.report.phase("remote_manifest"):
+            self.recover_journal(sftp, all_files)
+            present = {local_file.relative_path for local_file in all_files}
+            self.manifest.retain(present, within=scanned_dirs)
+
+            remote_manifest = None
+            if self.reconcile or not self.manifest.files or not self.remote_root_exists(sftp):
+                if not self.full_walk and self.files is None:
+                    # The remote copy is gone, everything has to be compared
+                    with self.report.phase("local_walk"):
+                        all_files = self.list_local_files()
+                    self.full_walk = True
+                remote_manifest = self.build_remote_manifest(session, sftp)
+        self.total_files = len(all_files)
+        files_to_upload = self.select_files(remote_manifest, all_files)
+        if self.checksum and files_to_upload:
+            with self.report.phase("checksum"):
+                files_to_upload = self.drop_unchanged_content(session, sftp, files_to_upload, remote_manifest)
+        self.report.count("files_selected", len(files_to_upload))
+        if self.is_canceled():
+            return
+        if not files_to_upload:
+            logger.info("No files need uploading - all files are up to date")
+            self.journal.close(complete=True)
+            self.progress(100)
+            return
+
+        logger.info(f"Uploading {len(files_to_upload)} changed/new files out of {len(all_files)} total files")
+        self.transfer_started = True
+        self.meter.total = sum(local_file.size or 0 for local_file in files_to_upload)
+
+        if self.keep_releases:
+            with self.report.phase("release"):
+                files_to_upload = self.stage_release(session, files_to_upload)
+
+        # Create all missing directories once, before any transfer starts
+        with self.report.phase("mkdir"):
+            self.prepare_remote_dirs(sftp, {posixpath.dirname(local_file.remote_path) for local_file in files_to_upload})
+
+        if self.release is None:
+            self.journal.start(files_to_upload)
+
+        try:
+            with self.report.phase("transfer"):
+                self.transfer(session, sftp, files_to_upload)
+        finally:
+            if self.checksum:
+                with self.report.phase("verify"):
+                    self.verify_uploads(session, files_to_upload)
+            with self.report.phase("chown"):
+                self.apply_ownership(session, self._chown_paths)
+            complete = len(self.uploaded) == len(files_to_upload)
+            if self.release is None:
+                self.journal.close(complete=complete)
+            else:
+                with self.report.phase("release"):
+                    self.finish_release(session, sftp, complete and not self.is_canceled())
+
+    def transfer(self, session, sftp, files_to_upload):
+        """Send many small files as one tar stream, the rest in parallel one by one"""
+        individual = files_to_upload
+        bulk = self.bulk_candidates(files_to_upload)
+        if bulk:
+            bulk_paths = {local_file.relative_path for local_file in bulk}
+            individual = [local_file for local_file in files_to_upload if local_file.relative_path not in bulk_paths]
+            # Whatever the server could not extract is sent one by one
+            individual += self.tar_upload(session, bulk)
+        if not individual or self.is_canceled():
+            return
+
+        # Spread the files over several SFTP channels on the same transport
+        pending = queue.Queue()
+        for item in individual:
+            pending.put(item)
+        # Worker index -> its channel and thread, workers stop and start as the tuner changes the streams
+        channels = {0: sftp}
+        threads = {}
+
+        def start_worker(index):
+            """Start worker index, False when the server refused another channel"""
+            if index not in channels:
+                try:
+                    channels[index] = session.open_sftp()
+                except Exception as e:
+                    logger.info(f"Could not open another SFTP channel, staying at {index}: {e}")
+                    if self.tuner is not None:
+                        self.tuner.limit_streams(index)
+                    return False
+            thread = threading.Thread(target=self.transfer_worker, args=(channels[index], session, pending, index), daemon=True)
+            threads[index] = thread
+            thread.start()
+            return True
+
+        try:
+            for index in range(min(self.tuner.streams if self.tuner else self.max_parallel(), len(individual))):
+                if not start_worker(index):
+                    break
+            while any(thread.is_alive() for thread in threads.values()):
+                if self.tuner is not None and not self.is_canceled():
+                    for index in range(self.tuner.streams):
+                        if pending.empty():
+                            break
+                        if (index not in threads or not threads[index].is_alive()) and not start_worker(index):
+                            break
+                time.sleep(0.1)
+        finally:
+            for thread in threads.values():
+                thread.join()
+            for index, channel in channels.items():
+                if index:
+                    channel.close()
+        if self.tuner is not None:
+            logger.info(f"Adaptive transfer settings: {self.tuner.streams} parallel, {self.tuner.chunk_size // 1024} KB chunks")
+
+    def recover_journal(self, sftp, all_files):
+        """Pick up where an interrupted sync stopped, see SyncJournal"""
+        pending, done = self.journal.recover()
+        for relative_path, entry in done.items():
+            self.manifest.files.setdefault(relative_path, entry)
+        if done:
+            logger.info(f"Recovered {len(done)} files uploaded by an interrupted sync")
+
+        local_files = {local_file.relative_path: local_file for local_file in all_files}
+        for relative_path, version in pending.items():
+            local_file = local_files.get(relative_path)
+            if local_file is not None and [local_file.size, local_file.mtime] == version:
+                self.resumable[relative_path] = version
+            else:
+                # The local file changed or is gone, its partial upload is useless
+                try:
+                    sftp.remove(self.partial_path(posixpath.join(self.remote_path, relative_path)))
+                except IOError:
+                    pass
+
+    def server_setting(self, key, default):
+        return server_setting(self.server_info, key, default)
+
+    def max_parallel(self):
+        return max(1, min(self.server_setting('max_parallel', DEFAULT_MAX_PARALLEL), self.max_streams()))
+
+    def max_streams(self):
+        """Parallel transfers that fit in the server's channels, half as many when each also runs gzip"""
+        channels = SERVER_MAX_CHANNELS - 1
+        return channels // 2 if self.compress_files else channels
+
+    def transfer_worker(self, sftp, session, pending, index=0):
+        """Upload files from the pending queue over one SFTP channel until it is empty.
+
+        Worker index stops early when the tuner lowered the streams below it.
+        """
+        while True:
+            self.wait_if_paused()
+            if self.is_canceled() or (self.tuner is not None and index >= self.tuner.streams):
+                return
+            try:
+                local_file = pending.get_nowait()
+            except queue.Empty:
+                return
+            counted = [0]
+
+            def on_bytes(size):
+                counted[0] += size
+                self.advance(size, local_file)
+
+            sent = 0
+            try:
+                sent = self.upload_file(sftp, session, local_file, on_bytes)
+            except UploadCanceled:
+                # Still pending in the journal, the next sync resumes its partial file
+                self.report.count("files_interrupted")
+                self.log(f"Canceled {os.path.basename(local_file.local_path)}, the next upload continues it")
+            except Exception as e:
+                self.failed.append((local_file.local_path, str(e)))
+                self.log(f"✖ Failed to upload {os.path.basename(local_file.local_path)}: {e}")
+                # Problems with the file itself say nothing about the link
+                if self.tuner is not None and not isinstance(e, (PermissionError, FileNotFoundError)):
+                    self.tuner.error()
+            # Blocks skipped by a delta transfer, or the rest of a failed file
+            self.advance((local_file.size or 0) - counted[0])
+            self.file_done(sent)
+
+    def file_done(self, sent=0):
+        with self._lock:
+            self._done += 1
+            self.bytes_sent += sent
+
+    def advance(self, size, local_file=None):
+        """Count size more bytes of the batch as done, and report progress"""
+        if local_file is not None and self.tuner is not None and size > 0:
+            self.tuner.sent(size)
+        with self._lock:
+            if local_file is not None:
+                self.current_file = local_file.relative_path
+            sampled = self.meter.update(self.meter.done + size)
+            done = self.meter.done >= self.meter.total
+            percent = self.meter.percent()
+            text = self.meter.text(self.current_file) if sampled or done else None
+        if text is not None:
+            self.progress(percent)
+            self.status(text)
+
+    def bulk_candidates(self, files_to_upload):
+        """The small files worth bundling into a tar stream, empty if too few"""
+        if not self.server_info.get('bulk_tar', True):
+            return []
+        small = [
+            local_file for local_file in files_to_upload
+            if local_file.size is not None and local_file.size < BULK_MAX_FILE_SIZE
+            and local_file.relative_path not in self.resumable
+        ]
+        return small if len(small) >= BULK_MIN_FILES else []
+
+    def tar_upload(self, session, local_files):
+        """Stream local_files as a tar archive into tar -x on the server, over one channel.
+
+        The archive is built on the fly, nothing is written locally. With a
+        user:group ownership the entries carry those names and are extracted
+        by root, so ownership is set in the same step. Like single uploads,
+        files are extracted to their partial names and only renamed into place,
+        with one more remote command, once the whole stream was extracted; a
+        stream that breaks off leaves the live files as they were.
+
+        Returns the files that still have to be uploaded one by one - all of
+        them if the server could not extract the stream.
+        """
+        owner, _, group = self.ownership_value.partition(":")
+        same_owner = bool(owner and group)
+        # Root extracts, so root also moves the files into place
+        sudo = "sudo -n " if same_owner else ""
+        if same_owner:
+            command = f"sudo -n tar -x --same-owner -f - -C {shlex.quote(self.upload_root)}"
+        else:
+            command = f"tar -x --no-same-owner -f - -C {shlex.quote(self.upload_root)}"
+        if self.release is not None:
+            # Replace the hard links to the previous release instead of writing through them
+            command += " --unlink-first"
+
+        errors = []
+        sent = []
+        sent_bytes = 0
+        channel = None
+        try:
+            stdin, stdout, stderr = session.exec_command(command)
+            channel = stdin.channel
+            # Drain stderr on the side, warnings per file must not stall the stream
+            drain = threading.Thread(target=lambda: errors.append(stderr.read()), daemon=True)
+            drain.start()
+            with tarfile.open(fileobj=ThrottledWriter(stdin, self.throttle), mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                for local_file in local_files:
+                    self.wait_if_paused()
+                    self.raise_if_canceled()
+                    with open(local_file.local_path, 'rb') as f:
+                        # From the open file, so a symlink is sent as the file it points to, as single uploads do
+                        info = tar.gettarinfo(arcname=posixpath.relpath(self.partial_path(local_file.remote_path), self.upload_root),
+                                              fileobj=f)
+                        info.mtime = int(local_file.mtime)
+                        if same_owner:
+                            info.uid = info.gid = 0
+                            info.uname, info.gname = owner, group
+                        tar.addfile(info, f)
+                    sent.append(local_file)
+                    sent_bytes += info.size
+                    self.file_done(info.size)
+                    self.advance(info.size, local_file)
+            stdin.flush()
+            stdin.channel.shutdown_write()
+            status = stdout.channel.recv_exit_status()
+            drain.join()
+            error = b"".join(errors).decode("utf-8", "replace").strip()
+        except UploadCanceled:
+            status = None
+        except Exception as e:
+            status, error = -1, str(e)
+        finally:
+            if channel is not None:
+                if not channel.exit_status_ready():
+                    # Broken off: let tar read to the end of the stream and exit before its files are removed
+                    try:
+                        channel.shutdown_write()
+                        channel.recv_exit_status()
+                    except Exception:
+                        pass
+                channel.close()
+        if status is None:
+            # The files stay pending in the journal, the next sync sends them again
+            if channel is not None:
+                self.remove_bundle_partials(session, sudo, local_files)
+            return []
+
+        if status == 0:
+            # One mv per file, fed to xargs so no command line limit applies
+            paths = b"".join(f"{self.partial_path(local_file.remote_path)}\0{local_file.remote_path}\0".encode("utf-8", "surrogateescape")
+                             for local_file in sent)
+            try:
+                status, _, errors = session.exec_with_input(f"{sudo}xargs -0 -n 2 mv -f --", paths)
+                error = errors.decode("utf-8", "replace").strip()
+            except Exception as e:
+                status, error = -1, str(e)
+
+        if status != 0:
+            if channel is not None:
+                # tar ran, so it may have left partial files
+                self.remove_bundle_partials(session, sudo, local_files)
+            self.log(f"Bulk upload failed ({error or f'exit status {status}'}), uploading the files one by one")
+            self.report.count("fallbacks")
+            with self._lock:
+                self._done -= len(sent)
+                self.bytes_sent -= sent_bytes
+            self.advance(-sent_bytes)
+            return local_files
+
+        self.report.count("bulk_files", len(sent))
+        for local_file in sent:
+            entry = self.manifest.record(local_file.relative_path, local_file.size, local_file.mtime,
+                                         self.local_digests.get(local_file.local_path))
+            self.journal.finished(local_file.relative_path, entry)
+            if not same_owner:
+                self._chown_paths.append(local_file.remote_path)
+            self.uploaded.append(local_file.remote_path)
+            self.log(f"✔ Uploaded (bundled): {os.path.basename(local_file.local_path)} → {local_file.remote_path}")
+        return []
+
+    def remove_bundle_partials(self, session, sudo, local_files):
+        """Remove the partial files of an incomplete tar stream, which may belong to the ownership user"""
+        paths = b"".join(f"{self.partial_path(local_file.remote_path)}\0".encode("utf-8", "surrogateescape") for local_file in local_files)
+        try:
+            session.exec_with_input(f"{sudo}xargs -0 rm -f --", paths)
+        except Exception as e:
+            logger.warning(f"Could not remove the partial files of a bulk upload: {e}")
+
+    def upload_file(self, sftp, session, local_file, on_bytes=None):
+        """Upload one file, on_bytes(size) is called as its data is written"""
+        local_path, remote_file_path = local_file.local_path, local_file.remote_path
+        on_bytes = on_bytes or (lambda size: None)
+        blocks = None
+        changed_blocks = None
+        if self.delta_threshold and local_file.size is not None and local_file.size >= self.delta_threshold:
+            blocks = self.scan.block_digests(local_file) if self.scan else block_sha256(local_path)
+            changed_blocks = self.delta_put(sftp, session, local_file, blocks, on_bytes)
+        compressed = None
+        if changed_blocks is None and self.should_compress(local_file):
+            compressed = self.compressed_put(sftp, session, local_file, on_bytes)
+        if changed_blocks is None and compressed is None:
+            sent = self.resumable_put(sftp, session, local_file, on_bytes)
+        try:
+            # Pin the remote mtime to the local one, see SyncManifest
+            sftp.utime(remote_file_path, (int(local_file.mtime), int(local_file.mtime)))
+        except IOError as e:
+            logger.warning(f"Could not set modification time of {remote_file_path}: {e}")
+        entry = self.manifest.record(local_file.relative_path, local_file.size, local_file.mtime,
+                                     self.local_digests.get(local_path), blocks)
+        self.journal.finished(local_file.relative_path, entry)
+        self._chown_paths.append(remote_file_path)
+        self.uploaded.append(remote_file_path)
+        if compressed is not None:
+            self.log(f"✔ Uploaded (compressed {local_file.size / max(compressed, 1):.1f}x): {os.path.basename(local_path)} → {remote_file_path}")
+            return compressed
+        if changed_blocks is None:
+            self.log(f"✔ Uploaded: {os.path.basename(local_path)} → {remote_file_path}")
+            return sent
+        self.report.count("delta_files")
+        self.log(f"✔ Updated {changed_blocks} of {len(blocks)} blocks: {os.path.basename(local_path)} → {remote_file_path}")
+        return min(changed_blocks * DELTA_BLOCK_SIZE, local_file.size)
+
+    def raise_if_canceled(self):
+        """Abort a running transfer, its partial file is resumed by the next sync"""
+        if self.is_canceled():
+            raise UploadCanceled("upload canceled")
+
+    @staticmethod
+    def partial_path(remote_file_path):
+        """Where a file is uploaded before it is renamed into place"""
+        return posixpath.join(posixpath.dirname(remote_file_path), f".{posixpath.basename(remote_file_path)}.sftp-partial")
+
+    def resumable_put(self, sftp, session, local_file, on_bytes):
+        """Upload to a partial file and rename it into place once complete, returns the bytes sent.
+
+        A partial file left by an interrupted sync of the same local file
+        version is continued from its current size.
+        """
+        partial_path = self.partial_path(local_file.remote_path)
+        offset = 0
+        if local_file.relative_path in self.resumable:
+            try:
+                offset = sftp.stat(partial_path).st_size
+            except IOError:
+                offset = 0
+            if offset > local_file.size:
+                offset = 0
+
+        if offset:
+            logger.info(f"Resuming {os.path.basename(local_file.local_path)} at {offset} of {local_file.size} bytes")
+        on_bytes(offset)
+        local_size = self.send_file(sftp, local_file.local_path, partial_path, offset, on_bytes)
+        size = sftp.stat(partial_path).st_size
+        if size != local_size:
+            raise IOError(f"size mismatch in upload! {size} != {local_size}")
+        self.replace_remote_file(sftp, session, partial_path, local_file.remote_path)
+        return local_size - offset
+
+    def current_chunk_size(self):
+        """Bytes read and written at a time: tuned or configured, at most a quarter second of the bandwidth limit"""
+        chunk_size = self.tuner.chunk_size if self.tuner else self.chunk_size
+        if self.bandwidth is not None and self.bandwidth.rate:
+            chunk_size = min(chunk_size, max(32 * 1024, self.bandwidth.rate // 4))
+        return chunk_size
+
+    def throttle(self, size):
+        """Wait until size more bytes fit in the bandwidth limit"""
+        if self.bandwidth is not None:
+            self.bandwidth.take(size)
+
+    def send_file(self, sftp, local_path, remote_path, offset=0, on_bytes=None):
+        """Write local_path to remote_path from offset on, returns the local size.
+
+        Reads a chunk at a time, memory-mapped for large files, and writes
+        pipelined, so requests are not held up waiting for each
+        acknowledgement.
+        """
+        chunk_size = self.current_chunk_size()
+        with open(local_path, 'rb') as f, sftp.open(remote_path, 'r+b' if offset else 'wb') as remote_file:
+            remote_file.set_pipelined(True)
+            remote_file.seek(offset)
+            size = os.fstat(f.fileno()).st_size
+            if size - offset >= chunk_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for start in range(offset, size, chunk_size):
+                        self.raise_if_canceled()
+                        chunk = data[start:start + chunk_size]
+                        self.throttle(len(chunk))
+                        remote_file.write(chunk)
+                        if on_bytes:
+                            on_bytes(len(chunk))
+            else:
+                f.seek(offset)
+                chunk = f.read()
+                self.throttle(len(chunk))
+                remote_file.write(chunk)
+                if on_bytes:
+                    on_bytes(len(chunk))
+        return size
+
+    def should_compress(self, local_file):
+        """Whether local_file is worth sending compressed: by extension, size and a sample"""
+        if (not self.compress_files or local_file.size is None or local_file.size < COMPRESS_MIN_SIZE
+                or local_file.relative_path in self.resumable
+                or not local_file.local_path.lower().endswith(COMPRESSIBLE_EXTENSIONS)):
+            return False
+        try:
+            with open(local_file.local_path, 'rb') as f:
+                sample = b""
+                for offset in (0, local_file.size // 2, max(0, local_file.size - COMPRESS_SAMPLE_SIZE)):
+                    f.seek(offset)
+                    sample += f.read(COMPRESS_SAMPLE_SIZE)
+        except OSError:
+            return False
+        return bool(sample) and len(zlib.compress(sample, COMPRESS_LEVEL)) <= COMPRESS_MAX_RATIO * len(sample)
+
+    def compressed_put(self, sftp, session, local_file, on_bytes):
+        """Stream local_file gzip-compressed into gzip -d on the server, returns the bytes sent.
+
+        The server decompresses into the partial file, which is renamed into
+        place once its size matches, as with resumable_put. Returns None
+        when the stream failed, the caller then uploads the file as it is.
+        Compression stops for the rest of the sync only when the server
+        can't run gzip: exit status 126/127, or gzip failing before any file
+        was compressed; a dropped stream only affects its own file.
+        """
+        partial_path = self.partial_path(local_file.remote_path)
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # 31: gzip format
+        chunk_size = self.current_chunk_size()
+        read = sent = 0
+        channel = None
+        try:
+            stdin, stdout, stderr = session.exec_command(f"gzip -dc > {shlex.quote(partial_path)}")
+            channel = stdin.channel
+            writer = ThrottledWriter(stdin, self.throttle)
+            with open(local_file.local_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    self.raise_if_canceled()
+                    data = compressor.compress(chunk)
+                    if data:
+                        writer.write(data)
+                        sent += len(data)
+                    read += len(chunk)
+                    on_bytes(len(chunk))
+                data = compressor.flush()
+                writer.write(data)
+                sent += len(data)
+            stdin.flush()
+            stdin.channel.shutdown_write()
+            status = stdout.channel.recv_exit_status()
+            error = stderr.read().decode("utf-8", "replace").strip()
+        except UploadCanceled:
+            raise
+        except Exception as e:
+            status, error = -1, str(e)
+            if channel is None:
+                # The server refused the channel, not the command: send this file as it is
+                logger.info(f"Could not open a channel for gzip, sending {local_file.relative_path} as it is: {e}")
+                return None
+        finally:
+            if channel is not None:
+                channel.close()
+        if status != 0:
+            on_bytes(-read)
+            self.report.count("fallbacks")
+            if status in (126, 127) or (status > 0 and not self.report.counters.get("compressed_files")):
+                self.compress_files = False
+                self.log(f"Compressed upload not possible ({error or f'exit status {status}'}), sending files as they are")
+            else:
+                logger.info(f"Compressed upload of {local_file.relative_path} failed ({error or f'exit status {status}'}), "
+                            f"sending it as it is")
+            return None
+
+        size = sftp.stat(partial_path).st_size
+        if size != read:
+            raise IOError(f"size mismatch in upload! {size} != {read}")
+        self.replace_remote_file(sftp, session, partial_path, local_file.remote_path)
+        self.report.count("compressed_files")
+        self.report.count("compression_saved_bytes", read - sent)
+        return sent
+
+    def delta_put(self, sftp, session, local_file, blocks, on_bytes):
+        """Update an existing remote file by sending only the blocks that changed.
+
+        The remote copy is duplicated to a temporary file next to it, the
+        changed blocks are written into that at their offsets and it is
+        renamed over the original, so readers never see a half-updated
+        file. Blocks are compared at fixed offsets, which catches the
+        in-place page updates of GeoPackages/SQLite and tiled rasters.
+        Returns the number of blocks sent, or None when a plain upload
+        has to be done instead.
+        """
+        remote_file_path = local_file.remote_path
+        try:
+            remote_attr = sftp.stat(remote_file_path)
+        except IOError:
+            return None  # New file
+
+        pushed = self.manifest.get(local_file.relative_path)
+        if (pushed and pushed.get("block_size") == DELTA_BLOCK_SIZE and pushed["size"] == remote_attr.st_size
+                and int(pushed["mtime"]) == remote_attr.st_mtime):
+            remote_blocks = pushed["blocks"]
+        else:
+            remote_blocks = self.remote_block_sha256(session, remote_file_path)
+            if remote_blocks is None:
+                return None
+
+        changed = [i for i, digest in enumerate(blocks) if i >= len(remote_blocks) or remote_blocks[i] != digest]
+        if len(changed) > DELTA_MAX_CHANGED * len(blocks):
+            return None
+
+        temp_path = posixpath.join(posixpath.dirname(remote_file_path), f".{posixpath.basename(remote_file_path)}.sftp-delta")
+        try:
+            status, _, errors = session.exec_with_input(f"cp -p -- {shlex.quote(remote_file_path)} {shlex.quote(temp_path)}", b"")
+        except Exception as e:
+            logger.info(f"Delta transfer not possible for {remote_file_path}: {e}")
+            return None
+        if status != 0:
+            logger.info(f"Delta transfer not possible for {remote_file_path}: {errors.decode('utf-8', 'replace').strip()}")
+            return None
+        try:
+            with open(local_file.local_path, 'rb') as f, sftp.open(temp_path, 'r+b') as remote_file:
+                remote_file.set_pipelined(True)
+                for i in changed:
+                    f.seek(i * DELTA_BLOCK_SIZE)
+                    remote_file.seek(i * DELTA_BLOCK_SIZE)
+                    block = f.read(DELTA_BLOCK_SIZE)
+                    self.throttle(len(block))
+                    remote_file.write(block)
+                    on_bytes(len(block))
+                remote_file.truncate(local_file.size)
+            self.replace_remote_file(sftp, session, temp_path, remote_file_path)
+        except Exception:
+            try:
+                sftp.remove(temp_path)
+            except IOError:
+                pass
+            raise
+        return len(changed)
+
+    def remote_block_sha256(self, session, remote_file_path):
+        """Per-block SHA-256 of a remote file via GNU split, None if the server can't do it"""
+        command = f"split -b {DELTA_BLOCK_SIZE} --filter=sha256sum -- {shlex.quote(remote_file_path)}"
+        try:
+            status, output, _ = session.exec_with_input(command, b"")
+        except Exception as e:
+            logger.info(f"Remote block checksums unavailable: {e}")
+            return None
+        if status != 0:
+            return None
+        return [line.split()[0] for line in output.decode("ascii", "replace").splitlines() if line.strip()]
+
+    def replace_remote_file(self, sftp, session, source_path, target_path):
+        """Atomically rename source_path over target_path"""
+        try:
+            sftp.posix_rename(source_path, target_path)
+        except IOError:
+            # Server without the posix-rename extension
+            status, _, errors = session.exec_with_input(f"mv -f -- {shlex.quote(source_path)} {shlex.quote(target_path)}", b"")
+            if status != 0:
+                raise IOError(f"Could not move {source_path} into place: {errors.decode('utf-8', 'replace').strip()}")
+
+    def list_local_files(self):
+        if self.scan is None:
+            entries, relative_dirs = walk_local_dir(self.local_dir, self.rules)
+        else:
+            entries, relative_dirs = self.scan.listing()
+            if self.server_info.get('rules'):
+                entries = [entry for entry in entries if not self.rules.excluded_path(entry[1])]
+                relative_dirs = {d for d in relative_dirs if not self.rules.excluded_path(d, True)}
+        self.local_dirs.update(relative_dirs)
+        return [
+            LocalFile(local_path, relative_path, posixpath.join(self.remote_path, relative_path), size, mtime)
+            for local_path, relative_path, size, mtime in entries
+        ]
+
+    def list_dirty_files(self, dirty_dirs, dirty_files):
+        """Stat only the files directly in dirty_dirs and the dirty_files.
+
+        Returns the files and the relative directories that were scanned
+        completely, whose manifest entries can be pruned.
+        """
+        files = {}
+        scanned_dirs = set()
+        for local_dir in dirty_dirs:
+            relative_dir = self.relative_path(local_dir)
+            if relative_dir is None or (relative_dir and self.rules.excluded_path(relative_dir, True)):
+                continue
+            scanned_dirs.add(relative_dir)
+            try:
+                entries = list(os.scandir(local_dir))
+            except OSError:
+                continue  # Removed, its files are forgotten
+            prefix = f"{relative_dir}/" if relative_dir else ""
+            for entry in entries:
+                if entry.is_file() and not self.rules.excluded(prefix + entry.name):
+                    files[entry.path] = self.local_file(entry.path)
+        for local_path in dirty_files:
+            relative_path = self.relative_path(local_path)
+            if (local_path not in files and relative_path and not self.rules.excluded_path(relative_path)
+                    and os.path.isfile(local_path)):
+                files[local_path] = self.local_file(local_path)
+        return list(files.values()), scanned_dirs
+
+    def list_project_files(self, local_paths):
+        """Stat the given files, remembering their directories for the remote listing"""
+        all_files, _ = self.list_dirty_files((), local_paths)
+        for local_file in all_files:
+            relative_dir = posixpath.dirname(local_file.relative_path)
+            while relative_dir:
+                self.local_dirs.add(relative_dir)
+                relative_dir = posixpath.dirname(relative_dir)
+        return all_files
+
+    def relative_path(self, local_path):
+        """"/" separated path relative to local_dir, "" for local_dir itself, None outside it"""
+        relative_path = os.path.relpath(local_path, self.local_dir).replace("\\", "/")
+        if relative_path == ".":
+            return ""
+        if relative_path == ".." or relative_path.startswith("../"):
+            return None
+        return relative_path
+
+    def local_file(self, local_path):
+        relative_path = self.relative_path(local_path)
+        remote_file_path = posixpath.join(self.remote_path, relative_path)
+        try:
+            st = os.stat(local_path)
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size, mtime = None, None
+        return LocalFile(local_path, relative_path, remote_file_path, size, mtime)
+
+    def remote_root_exists(self, sftp):
+        """The one remote round trip made when trusting the manifest"""
+        try:
+            sftp.stat(self.remote_path)
+            return True
+        except IOError:
+            logger.info("Remote path is gone, comparing against the remote files")
+            self.manifest.clear()
+            return False
+
+    def build_remote_manifest(self, session, sftp):
+        """Map remote file path -> (size, mtime) for the files below remote_path.
+
+        Directories found on the way are remembered as existing, so they are
+        not checked again before uploading.
+        """
+        if self.server_info.get('find_manifest'):
+            try:
+                return self.find_remote_manifest(session)
+            except Exception as e:
+                logger.info(f"Remote find failed, listing over SFTP instead: {e}")
+        return self.list_remote_manifest(sftp)
+
+    def list_remote_manifest(self, sftp):
+        """Build the manifest with one listdir_attr per remote directory.
+
+        Only directories that also exist locally are descended into, other
+        remote content can never be affected by the upload.
+        """
+        manifest = {}
+        root = self.remote_path.rstrip('/') or '/'
+        pending = [(root, '')]
+        while pending:
+            remote_dir, relative_dir = pending.pop()
+            try:
+                entries = sftp.listdir_attr(remote_dir)
+            except IOError:
+                continue  # Not uploaded yet
+            self._known_dirs.add(remote_dir)
+            for entry in entries:
+                remote_entry_path = posixpath.join(remote_dir, entry.filename)
+                relative_path = f"{relative_dir}/{entry.filename}" if relative_dir else entry.filename
+                if stat.S_ISDIR(entry.st_mode):
+                    if relative_path in self.local_dirs:
+                        pending.append((remote_entry_path, relative_path))
+                else:
+                    manifest[remote_entry_path] = (entry.st_size, entry.st_mtime)
+        return manifest
+
+    def find_remote_manifest(self, session):
+        """Build the manifest with a single remote GNU find, for servers with shell access"""
+        manifest = {}
+        root = self.remote_path.rstrip('/') or '/'
+        # -H: in release mode the remote path is a symlink to the live release
+        stdin, stdout, stderr = session.exec_command(f"find -H {shlex.quote(root)} -mindepth 1 -printf '%y %s %T@ %P\\0'")
+        output = stdout.read()
+        status = stdout.channel.recv_exit_status()
+        if status != 0:
+            raise IOError(f"exit status {status}: {stderr.read().decode('utf-8', 'replace').strip()}")
+
+        self._known_dirs.add(root)
+        for record in output.split(b"\0"):
+            if not record:
+                continue
+            kind, size, mtime, relative_path = record.decode("utf-8", "surrogateescape").split(" ", 3)
+            remote_entry_path = posixpath.join(root, relative_path)
+            if kind == "d":
+                self._known_dirs.add(remote_entry_path)
+            else:
+                manifest[remote_entry_path] = (int(size), int(float(mtime)))
+        return manifest
+
+    def select_files(self, remote_manifest, all_files):
+        """Return the files that need uploading (new or changed).
+
+        remote_manifest is None when the local manifest alone is trusted.
+        """
+        files_to_upload = []
+        yes_to_all = False
+        no_to_all = False
+        for local_file in all_files:
+            if self.is_canceled():
+                break
+            local_path = local_file.local_path
+            if local_file.mtime is None:
+                # If we can't check, upload it to be safe
+                files_to_upload.append(local_file)
+                continue
+
+            pushed = self.manifest.get(local_file.relative_path)
+            if local_file.relative_path in self.resumable:
+                changed = True
+                logger.debug(f"Continuing interrupted upload: {os.path.basename(local_path)}")
+            elif remote_manifest is None:
+                changed = not SyncManifest.matches(pushed, local_file.size, local_file.mtime)
+                if changed:
+                    logger.debug(f"File changed since last upload: {os.path.basename(local_path)}")
+            else:
+                # Check if remote file exists and get its modification time
+                remote_attr = remote_manifest.get(local_file.remote_path)
+                if remote_attr is None:
+                    # Remote file doesn't exist, upload it
+                    files_to_upload.append(local_file)
+                    logger.debug(f"New file: {os.path.basename(local_path)}")
+                    continue
+
+                remote_size, remote_mtime = remote_attr
+                if pushed is not None and pushed["size"] == remote_size and int(pushed["mtime"]) == remote_mtime:
+                    # The remote copy is what we uploaded last time, compare locally
+                    changed = not SyncManifest.matches(pushed, local_file.size, local_file.mtime)
+                else:
+                    # Unknown remote copy, only upload if local file is newer
+                    changed = local_file.mtime > remote_mtime
+                if changed:
+                    logger.debug(f"File changed: {os.path.basename(local_path)} (local: {local_file.mtime}, remote: {remote_mtime})")
+
+            if changed:
+                files_to_upload.append(local_file)
+                continue
+
+            # Unchanged, upload only if the user says so
+            if self.ask_overwrite is None or no_to_all:
+                logger.debug(f"File unchanged, skipping: {os.path.basename(local_path)}")
+                continue
+            if not yes_to_all:
+                answer = self.ask_overwrite(local_path)
+                if answer == OVERWRITE_YES_TO_ALL:
+                    yes_to_all = True
+                elif answer == OVERWRITE_NO_TO_ALL:
+                    no_to_all = True
+                    continue
+                elif answer != OVERWRITE_YES:
+                    continue
+            files_to_upload.append(local_file)
+        return files_to_upload
+
+    def drop_unchanged_content(self, session, sftp, files_to_upload, remote_manifest):
+        """Checksum mode: keep only the files whose content differs from the remote copy.
+
+        The remote digest comes from the manifest when the remote copy is
+        the one we uploaded, otherwise from a batched sha256sum on the
+        server for files of equal size.
+        """
+        self.local_digests.update(self.hash_cache.digests([local_file.local_path for local_file in files_to_upload]))
+
+        reference = {}
+        ask_remote = []
+        for local_file in files_to_upload:
+            pushed = self.manifest.get(local_file.relative_path)
+            if remote_manifest is None:
+                remote_attr = (pushed["size"], int(pushed["mtime"])) if pushed else None
+            else:
+                remote_attr = remote_manifest.get(local_file.remote_path)
+            if remote_attr is None or remote_attr[0] != local_file.size:
+                continue  # New file or different size, the content differs anyway
+            if pushed and pushed.get("sha256") and (pushed["size"], int(pushed["mtime"])) == tuple(remote_attr):
+                reference[local_file.remote_path] = pushed["sha256"]
+            else:
+                ask_remote.append(local_file.remote_path)
+        if ask_remote:
+            reference.update(self.remote_digests(session, ask_remote) or {})
+
+        changed = []
+        for local_file in files_to_upload:
+            digest = self.local_digests.get(local_file.local_path)
+            if digest is None or reference.get(local_file.remote_path) != digest:
+                changed.append(local_file)
+                continue
+            # Only touched: pin the new mtime so the next sync skips it without hashing
+            logger.debug(f"Content unchanged, skipping: {os.path.basename(local_file.local_path)}")
+            try:
+                sftp.utime(local_file.remote_path, (int(local_file.mtime), int(local_file.mtime)))
+                self.manifest.record(local_file.relative_path, local_file.size, local_file.mtime, digest)
+            except IOError as e:
+                logger.warning(f"Could not set modification time of {local_file.remote_path}: {e}")
+        return changed
+
+    def remote_digests(self, session, remote_paths):
+        """SHA-256 of remote files with one sha256sum per batch, None without shell access"""
+        digests = {}
+        for start in range(0, len(remote_paths), REMOTE_BATCH_SIZE):
+            batch = remote_paths[start:start + REMOTE_BATCH_SIZE]
+            try:
+                # Unreadable files just make sha256sum exit non-zero, the others are listed
+                _, output, _ = session.exec_with_input("xargs -0 -r sha256sum --", b"\0".join(path.encode("utf-8") for path in batch))
+            except Exception as e:
+                logger.info(f"Remote checksums unavailable: {e}")
+                return None
+            for line in output.decode("utf-8", "surrogateescape").splitlines():
+                digest, _, path = line.partition("  ")
+                if path:
+                    digests[path] = digest
+        return digests
+
+    def verify_uploads(self, session, files_to_upload):
+        """Compare the remote digest of every uploaded file with the local one"""
+        uploaded = set(self.uploaded)
+        uploaded_files = [local_file for local_file in files_to_upload if local_file.remote_path in uploaded]
+        if not uploaded_files:
+            return
+        remote = self.remote_digests(session, [local_file.remote_path for local_file in uploaded_files])
+        if remote is None:
+            self.log("Upload verification skipped, the server does not allow running sha256sum")
+            return
+        for local_file in uploaded_files:
+            if remote.get(local_file.remote_path) != self.local_digests.get(local_file.local_path):
+                self.uploaded.remove(local_file.remote_path)
+                self.failed.append((local_file.local_path, "checksum mismatch after upload"))
+                # Forget it, so the next sync uploads it again
+                self.manifest.files.pop(local_file.relative_path, None)
+                self.log(f"✖ Verification failed for {os.path.basename(local_file.local_path)}: checksum mismatch after upload")
+
+    def prepare_remote_dirs(self, sftp, remote_dirs):
+        """Make sure all remote_dirs exist, creating missing ones parents first.
+
+        Each directory is checked with a single stat at most; once a
+        directory had to be created its subdirectories are created without
+        checking.
+        """
+        created = set()
+        for remote_dir in sorted(remote_dirs):
+            path_so_far = ''
+            for d in remote_dir.strip('/').split('/'):
+                if not d:  # Skip empty strings
+                    continue
+                parent = path_so_far
+                path_so_far = f"{path_so_far}/{d}"
+                if path_so_far in self._known_dirs:
+                    continue
+                if parent not in created:
+                    try:
+                        if stat.S_ISDIR(sftp.stat(path_so_far).st_mode):
+                            self._known_dirs.add(path_so_far)
+                            continue
+                    except IOError:
+                        pass
+                try:
+                    sftp.mkdir(path_so_far)
+                except IOError as e:
+                    # The files below it will fail and be reported one by one
+                    self.log(f"✖ Failed to create directory {path_so_far}: {e}")
+                    break
+                remote_dir_cache.invalidate(self.server_info, parent or '/')
+                created.add(path_so_far)
+                self._known_dirs.add(path_so_far)
+                self._chown_paths.append(path_so_far)
+
+    def release_paths(self):
+        """(live path, its parent, the directory holding its releases)"""
+        live = self.remote_path.rstrip('/')
+        parent, name = posixpath.split(live)
+        if not name:
+            raise IOError("Release mode needs a remote path below /")
+        return live, parent, posixpath.join(parent, f".{name}.releases")
+
+    def stage_release(self, session, files_to_upload):
+        """Release mode: create the next release and redirect files_to_upload into it.
+
+        The release starts out as a copy of the live one made of hard links,
+        created with one remote cp -al, so only the changed files are sent.
+        Changed files replace their hard link by a rename, the previous
+        release is never written to. Returns files_to_upload with their
+        remote paths inside the release.
+        """
+        live, _, releases_dir = self.release_paths()
+        name = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        suffix = ""
+        while True:
+            release = posixpath.join(releases_dir, name + suffix)
+            quoted_live, quoted_release = shlex.quote(live), shlex.quote(release)
+            # The live copy is the release the symlink points to, or the directory of an in-place upload;
+            # its directories are listed, so they are not checked again and get their ownership set.
+            # Exit status 75: a release of the same second exists, try the next suffix
+            command = (f"mkdir -p -- {shlex.quote(releases_dir)} && "
+                       f"{{ mkdir -- {quoted_release} || {{ [ -e {quoted_release} ] && exit 75; exit 1; }}; }} && "
+                       f"if [ -d {quoted_live} ]; then cp -al -- {quoted_live}/. {quoted_release}/; fi && "
+                       f"find {quoted_release} -type d -print0")
+            status, output, errors = session.exec_with_input(command, b"")
+            if status != 75:
+                break
+            suffix = f"-{int(suffix[1:] or 1) + 1}"
+        if status != 0:
+            raise IOError(f"Could not create release {release}, release mode needs shell access: "
+                          f"{errors.decode('utf-8', 'replace').strip() or f'exit status {status}'}")
+        self.release = self.upload_root = release
+        for path in output.split(b"\0"):
+            if path:
+                path = path.decode("utf-8", "surrogateescape")
+                self._known_dirs.add(path)
+                self._chown_paths.append(path)
+        self._manifest_before = dict(self.manifest.files)
+        self.log(f"Staging release {posixpath.basename(release)} of {live}")
+        return [local_file._replace(remote_path=posixpath.join(release, local_file.relative_path))
+                for local_file in files_to_upload]
+
+    def finish_release(self, session, sftp, activate):
+        """Switch the live path over to the staged release, or drop the release.
+
+        The switch renames a new symlink over the live path, so readers see
+        either the old or the new release, never a mix. An in-place remote
+        directory is first moved into the releases, which leaves the path
+        missing for the moment between the two renames, once.
+        """
+        live, parent, releases_dir = self.release_paths()
+        name = posixpath.basename(self.release)
+        if not activate:
+            # Nothing of it reached the live path
+            self.manifest.files = self._manifest_before
+            try:
+                session.exec_with_input(f"rm -rf -- {shlex.quote(self.release)}", b"")
+            except Exception as e:
+                logger.warning(f"Could not remove release {self.release}: {e}")
+            self.log(f"✖ Release {name} not activated, {live} was left unchanged")
+            return
+
+        link = posixpath.join(parent, f".{posixpath.basename(live)}.sftp-link")
+        in_place = posixpath.join(releases_dir, name + IN_PLACE_RELEASE_SUFFIX)
+        command = (f"ln -sfn -- {shlex.quote(posixpath.relpath(self.release, parent))} {shlex.quote(link)} && "
+                   f"if [ -d {shlex.quote(live)} ] && [ ! -L {shlex.quote(live)} ]; "
+                   f"then mv -T -- {shlex.quote(live)} {shlex.quote(in_place)}; fi && "
+                   f"mv -T -- {shlex.quote(link)} {shlex.quote(live)}")
+        status, _, errors = session.exec_with_input(command, b"")
+        if status != 0:
+            self.manifest.files = self._manifest_before
+            raise IOError(f"Could not switch {live} to release {name}: "
+                          f"{errors.decode('utf-8', 'replace').strip() or f'exit status {status}'}")
+        remote_dir_cache.invalidate(self.server_info, parent or '/')
+        self.log(f"✔ Release {name} is live at {live}")
+        self.prune_releases(session, sftp, releases_dir)
+
+    def prune_releases(self, session, sftp, releases_dir):
+        """Remove all but the newest keep_releases releases, the live one always stays"""
+        try:
+            names = sorted(name for name in sftp.listdir(releases_dir) if not name.startswith("."))
+        except IOError as e:
+            logger.warning(f"Could not list releases in {releases_dir}: {e}")
+            return
+        older = [name for name in names if name != posixpath.basename(self.release)]
+        stale = older[:max(0, len(older) - (self.keep_releases - 1))]
+        if not stale:
+            return
+        paths = " ".join(shlex.quote(posixpath.join(releases_dir, name)) for name in stale)
+        try:
+            status, _, errors = session.exec_with_input(f"rm -rf -- {paths}", b"")
+            errors = errors.decode('utf-8', 'replace').strip()
+        except Exception as e:
+            status, errors = -1, str(e)
+        if status != 0:
+            self.log(f"✖ Failed to remove old releases: {errors or f'exit status {status}'}")
+            return
+        self.report.count("releases_pruned", len(stale))
+        logger.info(f"Removed {len(stale)} old releases from {releases_dir}")
+
+    def apply_ownership(self, session, paths):
+        """chown paths on the server, piping them NUL-delimited into xargs in batches"""
+        if not self.ownership_value or not paths:
+            return
+        command = f"xargs -0 -r sudo -n chown -- {shlex.quote(self.ownership_value)}"
+        for start in range(0, len(paths), REMOTE_BATCH_SIZE):
+            batch = paths[start:start + REMOTE_BATCH_SIZE]
+            try:
+                status, _, errors = session.exec_with_input(command, b"\0".join(path.encode("utf-8") for path in batch))
+                errors = errors.decode("utf-8", "replace").strip()
+            except Exception as e:
+                status, errors = -1, str(e)
+            if status != 0:
+                error = errors or f"exit status {status}"
+                self.ownership_errors.append(error)
+                self.log(f"✖ Failed to set ownership {self.ownership_value} on {len(batch)} paths: {error}")
+
+
+def main(argv=None):
+    """Command line entry point, returns the exit status"""
+    parser = argparse.ArgumentParser(
+        prog="python -m sftp_sync",
+        description="Upload local directories to a server configured in the AcuGIS SFTP plugin.",
+    )
+    parser.add_argument("server", nargs="?", help="name of a configured server")
+    parser.add_argument("targets", nargs="*", metavar="LOCAL_DIR REMOTE_PATH",
+                        help="local directory and the remote path to upload it to, can be repeated")
+    parser.add_argument("--config", default=CONFIG_FILE, help=f"server configuration (default {CONFIG_FILE})")
+    parser.add_argument("--list-servers", action="store_true", help="list the configured servers and exit")
+    parser.add_argument("--ownership", default="www-data:www-data",
+                        help="user:group set on uploaded files, empty to leave ownership alone (default www-data:www-data)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="list the remote side instead of trusting the manifest of the previous upload")
+    parser.add_argument("--checksum", action="store_true", default=None,
+                        help="compare and verify files by SHA-256 (default: the server's setting)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="PATTERN",
+                        help="gitignore-style exclude rule, added to the server's rules, can be repeated")
+    parser.add_argument("--releases", type=int, metavar="N",
+                        help="upload into a new release directory and switch over to it atomically, keeping N releases "
+                             "(0 = upload in place, default: the server's setting)")
+    parser.add_argument("--bandwidth-limit", type=int, metavar="KB_S",
+                        help="cap the upload at this many KB/s (0 = unlimited, default: the server's setting)")
+    parser.add_argument("--compress-files", action="store_true", default=None,
+                        help="send text, vector and uncompressed raster files gzip-compressed (default: the server's setting)")
+    parser.add_argument("--report-dir", help="write a JSON sync report per upload to this directory")
+    parser.add_argument("--quiet", action="store_true", help="only print errors and the summary")
+    parser.add_argument("--verbose", action="store_true", help="also print why each file is or isn't uploaded")
+    args = parser.parse_args(argv)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.ERROR if args.quiet else logging.DEBUG if args.verbose else logging.INFO)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot read {args.config}: {e}")
+    if args.list_servers:
+        for name, server_info in config.items():
+            print(f"{name}\t{server_info.get('username', '')}@{server_info.get('host', '')}:{server_info.get('port', 22)}")
+        return 0
+    if not args.server or not args.targets or len(args.targets) % 2:
+        parser.error("expected a server and one or more LOCAL_DIR REMOTE_PATH pairs")
+    if args.server not in config:
+        parser.error(f"server '{args.server}' not found in {args.config}")
+    server_info = config[args.server]
+    if args.releases is not None:
+        server_info = dict(server_info, releases=max(0, args.releases))
+    if args.compress_files:
+        server_info = dict(server_info, compress_files=True)
+    if args.bandwidth_limit is not None:
+        server_info = dict(server_info, bandwidth_limit=max(0, args.bandwidth_limit))
+
+    def log(message):
+        if not args.quiet or message.startswith("✖"):
+            print(message, flush=True)
+
+    exit_status = 0
+    try:
+        for local_dir, remote_path in zip(args.targets[::2], args.targets[1::2]):
+            if not os.path.isdir(local_dir):
+                print(f"✖ {local_dir} is not a directory", file=sys.stderr)
+                exit_status = 1
+                continue
+            job = SFTPSyncJob(server_info, os.path.abspath(local_dir), remote_path, args.ownership,
+                              log=log, reconcile=args.reconcile, checksum=args.checksum,
+                              report_dir=args.report_dir, rules="\n".join(args.exclude))
+            try:
+                job.run()
+            except Exception as e:
+                print(f"✖ Upload of {local_dir} to {args.server}:{remote_path} failed: {e}", file=sys.stderr)
+                exit_status = 1
+                continue
+            print(f"{local_dir} -> {args.server}:{remote_path}: {len(job.uploaded)} of {job.total_files} files uploaded, "
+                  f"{len(job.failed)} failed ({job.report.summary()})", flush=True)
+            if job.failed or job.ownership_errors:
+                exit_status = 1
+            learned = job.learned_tuning()
+            if learned:
+                try:
+                    remember_tuning(server_info, learned, args.config)
+                except (OSError, ValueError) as e:
+                    print(f"Could not save the learned transfer settings: {e}", file=sys.stderr)
+                server_info = dict(server_info, learned=learned)
+    except KeyboardInterrupt:
+        exit_status = 130
+    finally:
+        connection_pool.close_all()
+    return exit_status
+
+
+if __name__ == "__main__":
+    sys.exit(main())